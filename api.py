@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+import os
+
+import x32_toolkit
+import template_cache
+import primitives
+import instrument
+from scene import Scene
+
+
+# the cache used when none is passed, shared with session_build
+templates = template_cache.templates
+
+
+def load_sheet(csv_file):
+    """Return the patch sheet of csv_file as {session: {base: new}}."""
+    if not os.path.exists(csv_file):
+        raise ValueError(f'File {csv_file} does not exist.')
+    sheet = templates.sheet(csv_file)
+    if sheet is None:
+        raise ValueError(f'{csv_file} has no Base column.')
+    return sheet
+
+
+def session_rename_dict(sheet, session_name):
+    """Return the rename mapping of one session of a patch sheet."""
+    if session_name not in sheet:
+        raise ValueError(f'Session {session_name} does not exist.')
+    return sheet[session_name]
+
+
+def _report(report):
+    return {'applied': [{'type': ch_type, 'number': ch_num, 'old': old,
+                         'new': new}
+                        for ch_type, ch_num, old, new in report.applied],
+            'missing': [name for name, _ in report.missing]}
+
+
+def rename_scene(scene_file, rename_dict, output=None, strip_types=None):
+    """Rename the strips of a scene and write it to output (default: in
+    place). Returns the applied and missing names."""
+    scene = Scene.load(scene_file)
+    report = x32_toolkit.rename(scene, rename_dict, strip_types)
+    scene.export(output or scene_file)
+    return {'output': output or scene_file, **_report(report)}
+
+
+def move_strips(scene_file, moves, output=None):
+    """Move whole strips of a scene and write it to output (default: in
+    place). moves is {strip type: {from: to}}, see StripPermutation."""
+    scene = Scene.load(scene_file)
+    x32_toolkit.permute_strips(scene, moves)
+    scene.export(output or scene_file)
+    return {'output': output or scene_file}
+
+
+def create_scenes(scene_file, sheet, target_dir, sessions=None,
+                  cache=templates):
+    """Create the scene of every session of sheet (or only of sessions)
+    from scene_file in target_dir.
+
+    Returns [{'session', 'path', 'missing'}]."""
+    os.makedirs(target_dir, exist_ok=True)
+    template = cache.scene(scene_file)
+    prefix = os.path.splitext(os.path.basename(scene_file))[0]
+    results = []
+    for session_name in sessions or sheet:
+        rename_dict = session_rename_dict(sheet, session_name)
+        new_file = os.path.join(target_dir, f'{prefix}_{session_name}.scn')
+        with instrument.phase('render scene', base=prefix,
+                              session=session_name):
+            missing = template.render(rename_dict,
+                                      f'{prefix}_{session_name}', new_file)
+        results.append({'session': session_name, 'path': new_file,
+                        'missing': missing})
+    return results
+
+
+def create_projects(project_file, sheet, target_dir, sessions=None,
+                    clone='reflink', strict=False, cache=templates):
+    """Create the Logic project of every session of sheet (or only of
+    sessions) from project_file in target_dir.
+
+    Existing projects are left alone and reported with path None. With
+    strict, names of the sheet missing from the project raise ValueError
+    before anything is created. Returns [{'session', 'path', 'missing'}]."""
+    os.makedirs(target_dir, exist_ok=True)
+    template = cache.project(project_file, primitives.base_names(sheet))
+    missing = template.missing()
+    if strict and missing:
+        raise ValueError(f'names not found in {project_file}: '
+                         f'{", ".join(missing)}')
+    results = []
+    for session_name in sessions or sheet:
+        rename_dict = session_rename_dict(sheet, session_name)
+        new_file = os.path.join(target_dir,
+                                template.project_name(session_name))
+        if os.path.exists(new_file):
+            results.append({'session': session_name, 'path': None,
+                            'missing': missing,
+                            'error': f'{new_file} already exists'})
+            continue
+        with instrument.phase('render project',
+                              base=os.path.basename(project_file),
+                              session=session_name):
+            path = template.render(session_name, rename_dict, target_dir,
+                                   clone=clone)
+        results.append({'session': session_name, 'path': path,
+                        'missing': missing})
+    return results
+
+
+def build(csv_file, base_dir, target_dir, sessions=None, clone='reflink',
+          strict=False, cache=templates):
+    """Create the outputs of every base file in base_dir for the sessions
+    of csv_file. Returns {base file: results}, see create_scenes and
+    create_projects. Other files of base_dir are skipped."""
+    sheet = load_sheet(csv_file)
+    results = {}
+    for name in sorted(os.listdir(base_dir)):
+        if name.startswith('.'):
+            continue
+        file = os.path.join(base_dir, name)
+        if primitives.is_logicx(file):
+            results[file] = create_projects(file, sheet, target_dir,
+                                            sessions, clone, strict, cache)
+        elif primitives.is_scn(file):
+            results[file] = create_scenes(file, sheet, target_dir, sessions,
+                                          cache)
+    return results
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+import io
+import os
+import time
+import shutil
+import tarfile
+import zipfile
+
+# archive extension -> tarfile mode
+TAR_MODES = {'.tar': 'w', '.tar.gz': 'w:gz', '.tgz': 'w:gz',
+             '.tar.bz2': 'w:bz2', '.tar.xz': 'w:xz'}
+
+
+def archive_format(path):
+    """Return 'zip' or the tarfile mode for an archive path, or None if
+    path is not an archive."""
+    name = path.lower()
+    if name.endswith('.zip'):
+        return 'zip'
+    for ext, mode in TAR_MODES.items():
+        if name.endswith(ext):
+            return mode
+    return None
+
+
+class ArchiveWriter:
+    """Writes the outputs of a build into one zip or tar archive.
+
+    The archive is written front to back, without temporary files. Files
+    added more than once from the same source, like the unchanged files of
+    a Logic project in every session, are stored once in a tar archive and
+    added again as hard links to the first copy. Zip has no links, so
+    there they are stored again, but uncompressed (stored=True).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.format = archive_format(path)
+        if self.format is None:
+            raise ValueError(f'{path} is not a zip or tar archive.')
+        if self.format == 'zip':
+            self._archive = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+        else:
+            self._archive = tarfile.open(path, self.format)
+        # source path -> name of its first copy in the archive
+        self._stored = {}
+
+    def add_bytes(self, name, data, mode=0o644):
+        if self.format == 'zip':
+            info = zipfile.ZipInfo(name, time.localtime()[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.external_attr = (0o100000 | mode) << 16
+            self._archive.writestr(info, data)
+            return
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mode = mode
+        info.mtime = int(time.time())
+        self._archive.addfile(info, io.BytesIO(data))
+
+    def add_file(self, name, source, stored=False):
+        """Add the file source as name. stored files are not compressed in
+        a zip archive."""
+        if self.format == 'zip':
+            compress_type = (zipfile.ZIP_STORED if stored
+                             else zipfile.ZIP_DEFLATED)
+            info = zipfile.ZipInfo.from_file(source, name)
+            info.compress_type = compress_type
+            with open(source, 'rb') as src, \
+                    self._archive.open(info, 'w') as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            return
+        key = os.path.realpath(source)
+        info = self._archive.gettarinfo(source, name)
+        if info.isreg() and key in self._stored:
+            info.type = tarfile.LNKTYPE
+            info.linkname = self._stored[key]
+            info.size = 0
+            self._archive.addfile(info)
+            return
+        if info.isreg():
+            self._stored[key] = name
+            with open(source, 'rb') as src:
+                self._archive.addfile(info, src)
+        else:
+            self._archive.addfile(info)
+
+    def close(self):
+        self._archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
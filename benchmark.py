@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+
+import x32_toolkit
+import logic_rename
+import primitives
+from scene import Scene, SceneTemplate
+
+BLANK = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'BLANK.scn')
+# distance of the names straddling a boundary in generated ProjectData
+BOUNDARY = 64 * 1024
+
+SHEET_SESSIONS = (10, 100, 500)
+SHEET_NAMES = 200
+PROJECT_SIZES_MB = (0.3, 10, 100)
+QUICK_SHEET_SESSIONS = (10, 100)
+QUICK_PROJECT_SIZES_MB = (0.3, 10)
+
+
+def make_scene(file):
+    """Write BLANK.scn with every strip named to file. Returns the scene."""
+    scene = Scene.load(BLANK)
+    for (ch_type, ch_num) in list(scene.names):
+        path = f'/{ch_type}/{ch_num}/config'
+        m = primitives.CHANNEL_RE.match(f'{path} {scene[path]}')
+        if m is not None:
+            scene[path] = primitives.renamed_config(
+                m, f'{ch_type.upper()}{ch_num}')
+    scene.export(file)
+    return scene
+
+
+def make_names(count):
+    return [f'TRK{i:04d}' for i in range(count)]
+
+
+def make_sheet(file, sessions, names):
+    """Write a patch sheet of sessions columns renaming names."""
+    with open(file, 'w', newline='', encoding='utf-8') as f:
+        f.write(';'.join(['Base'] + [f'S{j:03d}' for j in range(sessions)])
+                + '\n')
+        for i, name in enumerate(names):
+            f.write(';'.join([name] + [f'N{i:03d}_{j:03d}'
+                                       for j in range(sessions)]) + '\n')
+
+
+def make_project_data(file, size, names):
+    """Write size bytes of filler with padded names to file.
+
+    Every name occurs several times. One name starts a few bytes before
+    every multiple of BOUNDARY, so it straddles the boundary."""
+    rng = random.Random(0)
+    # filler without '_', so no name can grow a padding by accident
+    data = bytearray(rng.randbytes(size).replace(b'_', b'.'))
+    padded = [(name + '_' * (logic_rename.MAX_NAME_LEN - len(name))).encode()
+              for name in names]
+    for i, offset in enumerate(range(BOUNDARY - 5, size - 32, BOUNDARY)):
+        name = padded[i % len(padded)]
+        data[offset:offset + len(name)] = name
+    for i in range(min(len(padded) * 4, size // 64)):
+        offset = rng.randrange(0, size - 32)
+        name = padded[i % len(padded)]
+        data[offset:offset + len(name)] = name
+    with open(file, 'wb') as f:
+        f.write(data)
+
+
+def _size(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, name))
+                   for root, _, files in os.walk(path) for name in files)
+    return os.path.getsize(path)
+
+
+def measure(func, setup=None, repeat=3):
+    """Run func repeat times and once more under tracemalloc.
+
+    func returns the number of bytes it wrote. setup runs untimed before
+    every run. Returns (best seconds, peak traced bytes, bytes written).
+    Memory-mapped files are not traced, only Python allocations."""
+    best = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        written = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return best, peak, written
+
+
+def bench_rename(work_dir, scene_file):
+    scene = Scene.load(scene_file)
+    rename_dict = {name: f'{name}x' for name in scene.names.values() if name}
+
+    def run():
+        x32_toolkit.rename(scene.copy(), rename_dict)
+        return 0
+    yield 'rename', {'names': len(rename_dict)}, run, None
+
+
+def bench_swap_channels(work_dir, scene_file):
+    scene = Scene.load(scene_file)
+    swap_dict = {n: 33 - n for n in range(1, 33)}
+
+    def run():
+        x32_toolkit.swap_channels(scene.copy(), swap_dict)
+        return 0
+    yield 'swap_channels', {'channels': 32}, run, None
+
+
+def bench_create_named_scenes(work_dir, scene_file, sessions):
+    template = SceneTemplate(Scene.load(scene_file))
+    names = list(Scene.load(scene_file).names.values())
+    sheet = {f'S{j:03d}': {name: f'{name}_{j}' for name in names if name}
+             for j in range(sessions)}
+    target_dir = os.path.join(work_dir, f'scenes_{sessions}')
+
+    def setup():
+        shutil.rmtree(target_dir, ignore_errors=True)
+        os.makedirs(target_dir)
+
+    def run():
+        for session_name, rename_dict in sheet.items():
+            x32_toolkit.create_named_scene(template, 'BLANK', session_name,
+                                           rename_dict, target_dir)
+        return _size(target_dir)
+    yield 'create_named_scenes', {'sessions': sessions}, run, setup
+
+
+def bench_rename_in_file(work_dir, size_mb):
+    size = int(size_mb * 1024 * 1024)
+    names = make_names(SHEET_NAMES)
+    source = os.path.join(work_dir, f'ProjectData_{size_mb}')
+    make_project_data(source, size, names)
+    target = source + '.work'
+    rename_dict = logic_rename._project_names(
+        {name: f'{name}_new' for name in names})
+
+    def setup():
+        shutil.copyfile(source, target)
+
+    def run():
+        logic_rename.rename_in_file(target, rename_dict)
+        return size
+    yield ('rename_in_file', {'mb': size_mb, 'names': len(names)}, run,
+           setup)
+
+
+def bench_load_patch_sheet(work_dir, sessions):
+    csv_file = os.path.join(work_dir, f'sheet_{sessions}.csv')
+    make_sheet(csv_file, sessions, make_names(SHEET_NAMES))
+
+    def run():
+        primitives.load_patch_sheet(csv_file)
+        return 0
+    yield ('load_patch_sheet', {'sessions': sessions, 'names': SHEET_NAMES},
+           run, None)
+
+
+def benchmarks(work_dir, quick=False, only=''):
+    """Generate the inputs in work_dir and yield (name, params, func,
+    setup) of every benchmark whose name contains only."""
+    scene_file = os.path.join(work_dir, 'named.scn')
+    make_scene(scene_file)
+    sessions = QUICK_SHEET_SESSIONS if quick else SHEET_SESSIONS
+    sizes = QUICK_PROJECT_SIZES_MB if quick else PROJECT_SIZES_MB
+    if only in 'rename':
+        yield from bench_rename(work_dir, scene_file)
+    if only in 'swap_channels':
+        yield from bench_swap_channels(work_dir, scene_file)
+    if only in 'create_named_scenes':
+        for count in sessions:
+            yield from bench_create_named_scenes(work_dir, scene_file, count)
+    if only in 'rename_in_file':
+        for size_mb in sizes:
+            yield from bench_rename_in_file(work_dir, size_mb)
+    if only in 'load_patch_sheet':
+        for count in sessions:
+            yield from bench_load_patch_sheet(work_dir, count)
+
+
+def _commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+            text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+            check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Time the hot paths of the toolkit on generated inputs.')
+    parser.add_argument('-o', '--output',
+                        help='write the results as json to this file')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='timed runs per benchmark, the best counts '
+                             '(default: 3)')
+    parser.add_argument('--quick', action='store_true',
+                        help='only the smaller inputs')
+    parser.add_argument('-k', '--filter', default='',
+                        help='only run benchmarks whose name contains this')
+    args = parser.parse_args()
+    results = []
+    print(f'{"benchmark":<22} {"params":<26} {"seconds":>10} '
+          f'{"peak KiB":>10} {"written KiB":>12}')
+    with tempfile.TemporaryDirectory() as work_dir:
+        for name, params, func, setup in benchmarks(work_dir, args.quick,
+                                                    args.filter):
+            seconds, peak, written = measure(func, setup, args.repeat)
+            results.append({'name': name, 'params': params,
+                            'seconds': seconds, 'peak_bytes': peak,
+                            'bytes_written': written})
+            param_str = ' '.join(f'{k}={v}' for k, v in params.items())
+            print(f'{name:<22} {param_str:<26} {seconds:>10.4f} '
+                  f'{peak / 1024:>10.0f} {written / 1024:>12.0f}')
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({'commit': _commit(),
+                       'python': platform.python_version(),
+                       'platform': sys.platform,
+                       'repeat': args.repeat,
+                       'results': results}, f, indent=1)
+        print(f'Results saved to {args.output}.')
+
+
+if __name__ == '__main__':
+    main()
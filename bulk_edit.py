@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import sys
+import math
+import shlex
+import fnmatch
+import argparse
+import functools
+
+import primitives
+import instrument
+
+# an assignment of an edit: field=value, field+=value or field-=value
+ASSIGNMENT_RE = re.compile(r'(?P<field>\w+)(?P<op>[+-]?=)(?P<value>.*)$')
+
+# the field names of common lines, by the path they occur in.
+# field numbers (1, 2, ...) work for every line
+FIELD_NAMES = [
+    (re.compile(r'.*/config$'),
+     {'name': 0, 'icon': 1, 'color': 2, 'input': 3}),
+    (re.compile(r'.*/preamp$'),
+     {'trim': 0, 'invert': 1, 'hpon': 2, 'hpslope': 3, 'hpf': 4}),
+    (re.compile(r'.*/mix/\d\d$'),
+     {'on': 0, 'level': 1, 'pan': 2, 'type': 3}),
+    (re.compile(r'/(?:main/\w+|mtx/\d+)/mix$'),
+     {'on': 0, 'fader': 1, 'pan': 2}),
+    (re.compile(r'.*/mix$'),
+     {'on': 0, 'fader': 1, 'st': 2, 'pan': 3, 'mono': 4, 'mlevel': 5}),
+    (re.compile(r'.*/eq/\d$'),
+     {'type': 0, 'f': 1, 'g': 2, 'q': 3}),
+    (re.compile(r'/dca/\d$'),
+     {'on': 0, 'fader': 1}),
+]
+# how the values of named fields are written
+FIELD_KINDS = {'trim': 'db', 'level': 'db', 'fader': 'db', 'mlevel': 'db',
+               'g': 'db', 'f': 'freq', 'hpf': 'freq'}
+# every field name of FIELD_NAMES
+KNOWN_FIELDS = {name for _, names in FIELD_NAMES for name in names}
+# levels at or below this are -oo
+MIN_DB = -90.0
+
+
+def parse_db(text):
+    """Parse a level like -6.0, +0 or -oo. Returns a float, -inf for -oo."""
+    if text in ('-oo', '-inf'):
+        return -math.inf
+    return float(text)
+
+
+def format_db(value, decimals=1):
+    if value <= MIN_DB:
+        return '-oo'
+    return f'{value:+.{decimals}f}'
+
+
+def parse_freq(text):
+    """Parse a frequency like 124.7, 1k97, 10k02 or 2k. Returns Hz."""
+    if 'k' in text:
+        thousands, _, rest = text.partition('k')
+        return float(thousands or 0) * 1000 + (
+            float(f'0.{rest}') * 1000 if rest else 0)
+    return float(text)
+
+
+def format_freq(value, decimals=1):
+    """Write a frequency the way X32 scenes do: 124.7, 1k97, 10k02."""
+    if value >= 1000:
+        tens = round(value / 10)
+        return f'{tens // 100}k{tens % 100:02d}'
+    return f'{value:.{decimals}f}'
+
+
+def _decimals(token, default=1):
+    if token == '-oo':
+        return default
+    _, dot, decimals = token.partition('.')
+    return len(decimals) if dot else 0
+
+
+def _parser(kind):
+    return {'db': parse_db, 'freq': parse_freq}.get(kind, float)
+
+
+def check_value(kind, op, operand):
+    """Raise ValueError if operand can not be assigned with op to a field
+    of kind (None for numbered fields)."""
+    if kind is None and op == '=':
+        return
+    # a relative change of a numbered field may be a level or a frequency
+    try:
+        _parser(kind or 'freq')(operand)
+    except ValueError:
+        raise ValueError(f'{operand} is no '
+                         f'{"number" if kind is None else kind} value') \
+            from None
+
+
+@functools.lru_cache(maxsize=4096)
+def _new_value(kind, op, operand, token):
+    """Return the new text of a field currently reading token.
+
+    Cached, since a batch of scenes repeats the same few values of every
+    field many times."""
+    if kind is None and op == '=':
+        if token.startswith('"') and not operand.startswith('"'):
+            return f'"{operand}"'
+        return operand
+    if kind is None:
+        # an unnamed numeric field, guess the kind from its text
+        kind = ('freq' if 'k' in token else
+                'db' if token == '-oo' or token[:1] in '+-' else 'num')
+    parse = _parser(kind)
+    write = {'db': format_db, 'freq': format_freq}.get(
+        kind, lambda v, d: f'{v:.{d}f}')
+    value = parse(operand)
+    if op != '=':
+        try:
+            current = parse(token)
+        except ValueError:
+            raise ValueError(f'can not change {token} by {operand}') \
+                from None
+        value = current + (value if op == '+=' else -value)
+    return write(value, _decimals(token))
+
+
+class Edit:
+    """One edit: the lines of a path glob, optionally only of strips whose
+    name matches a name glob, get new field values.
+
+    ``*`` and ``?`` of the path glob do not match ``/``. assignments are
+    (field, op, value), field a name of FIELD_NAMES or a field number
+    counting from 1, op one of ``=``, ``+=`` and ``-=``. Several
+    assignments to one field apply in order."""
+
+    def __init__(self, path_glob, assignments, name_glob=None):
+        self.path_glob = path_glob
+        self.name_glob = name_glob
+        self.assignments = assignments
+        self.path_re = glob_to_re(path_glob)
+        self._name_re = (None if name_glob is None
+                         else re.compile(fnmatch.translate(name_glob)))
+
+    def matches_name(self, name):
+        return (self._name_re is None
+                or (name is not None and self._name_re.match(name)))
+
+    def fields(self, path):
+        """Return [(field index, op, value, kind)] of this edit for path,
+        leaving out named fields path does not have."""
+        names = {}
+        for path_re, field_names in FIELD_NAMES:
+            if path_re.match(path):
+                names = field_names
+                break
+        fields = []
+        for field, op, value in self.assignments:
+            if field.isdigit():
+                fields.append((int(field) - 1, op, value, None))
+            elif field in names:
+                fields.append((names[field], op, value,
+                               FIELD_KINDS.get(field)))
+        return fields
+
+    @classmethod
+    def parse(cls, text):
+        """Parse ``PATH [strip=GLOB] FIELD=VALUE ...``, e.g.
+        ``/ch/*/preamp strip=DRUM* trim=-18``. Raises ValueError."""
+        words = shlex.split(text)
+        if len(words) < 2:
+            raise ValueError(f'an edit needs a path and assignments: {text}')
+        name_glob = None
+        assignments = []
+        for word in words[1:]:
+            m = ASSIGNMENT_RE.match(word)
+            if m is None:
+                raise ValueError(f'{word} is no assignment')
+            if m.group('field') == 'strip' and m.group('op') == '=':
+                name_glob = m.group('value')
+                continue
+            field, op, value = m.group('field', 'op', 'value')
+            if field.isdigit() and int(field) < 1:
+                raise ValueError(f'{word}: fields count from 1')
+            if not field.isdigit() and field not in KNOWN_FIELDS:
+                raise ValueError(f'{word}: unknown field {field}, use a '
+                                 f'field number or one of '
+                                 f'{", ".join(sorted(KNOWN_FIELDS))}')
+            try:
+                check_value(FIELD_KINDS.get(field), op, value)
+            except ValueError as e:
+                raise ValueError(f'{word}: {e}') from None
+            assignments.append((field, op, value))
+        if not assignments:
+            raise ValueError(f'an edit needs assignments: {text}')
+        return cls(words[0], assignments, name_glob)
+
+
+def glob_to_re(glob):
+    """Translate an OSC path glob, where * and ? stay within one part."""
+    parts = []
+    for c in glob:
+        if c == '*':
+            parts.append('[^/]*')
+        elif c == '?':
+            parts.append('[^/]')
+        else:
+            parts.append(re.escape(c))
+    return ''.join(parts)
+
+
+class BulkEdit:
+    """A list of Edits compiled for applying them to many scenes.
+
+    All path globs are joined into one regular expression, which skips
+    the lines no edit applies to. Which edits apply to a path is worked
+    out once per path and reused for every further scene.
+    """
+
+    def __init__(self, edits):
+        self.edits = list(edits)
+        self._matcher = re.compile('|'.join(
+            f'(?:{edit.path_re})' for edit in self.edits) or '(?!)')
+        self._compiled = [re.compile(edit.path_re) for edit in self.edits]
+        self._plans = {}
+
+    def _plan(self, path):
+        """Return [(edit, fields)] of the edits applying to path."""
+        plan = self._plans.get(path)
+        if plan is None:
+            plan = []
+            if self._matcher.fullmatch(path):
+                for edit, path_re in zip(self.edits, self._compiled):
+                    if path_re.fullmatch(path):
+                        fields = edit.fields(path)
+                        if fields:
+                            plan.append((edit, fields))
+            self._plans[path] = plan
+        return plan
+
+    def edit_line(self, path, args, name):
+        """Return the new args of a line. name is the name of the strip
+        the path belongs to, None for other paths. Raises ValueError if a
+        field can not be changed."""
+        for edit, fields in self._plan(path):
+            if not edit.matches_name(name):
+                continue
+            tokens = list(primitives.FIELD_RE.finditer(args))
+            # field index -> new text
+            values = {}
+            for index, op, value, kind in fields:
+                if index < len(tokens):
+                    values[index] = _new_value(
+                        kind, op, value,
+                        values.get(index, tokens[index].group()))
+            # replace from the last field, so earlier spans stay valid
+            for index in sorted(values, reverse=True):
+                start, end = tokens[index].span()
+                args = args[:start] + values[index] + args[end:]
+        return args
+
+    def edit_lines(self, lines):
+        """Yield (line, edited line) of the lines of a scene, in one pass.
+
+        The name filter relies on the config line of a strip coming before
+        its other lines, as in every scene saved by an X32."""
+        names = {}
+        for line in lines:
+            new = line
+            path, sep, args = line.rstrip('\r\n').partition(' ')
+            if sep and not path.startswith('#'):
+                # the strip of the path, e.g. /ch/01 of /ch/01/mix/13
+                m = primitives.STRIP_SECTION_RE.match(path)
+                strip = path[:m.end('ch_num')] if m is not None else None
+                if strip is not None and path == f'{strip}/config':
+                    m_name = primitives.CONFIG_NAME_RE.match(args)
+                    if m_name is not None:
+                        names[strip] = m_name.group('name')
+                new_args = self.edit_line(path, args, names.get(strip))
+                if new_args != args:
+                    new = f'{path} {new_args}\n'
+            yield line, new
+
+    def edit_file(self, file, out_file):
+        """Edit the scene file into out_file, which may be file itself.
+        Returns the number of changed lines. On errors out_file is left as
+        it was."""
+        changed = number = 0
+        tmp_file = f'{out_file}.tmp'
+        with instrument.phase('bulk edit', scene=os.path.basename(file)):
+            try:
+                with open(file, 'r') as f, open(tmp_file, 'w') as out:
+                    for number, (line, new) in enumerate(
+                            self.edit_lines(f), 1):
+                        if new is not line:
+                            changed += 1
+                        out.write(new)
+            except ValueError as e:
+                os.remove(tmp_file)
+                # number is the last line edited before the failing one
+                raise ValueError(f'line {number + 1}: {e}') from None
+            except OSError:
+                if os.path.exists(tmp_file):
+                    os.remove(tmp_file)
+                raise
+            os.replace(tmp_file, out_file)
+        return changed
+
+
+def load_edits(file):
+    """Return the Edits of an edit file, one per line. Empty lines and
+    lines starting with # are skipped. Raises ValueError."""
+    edits = []
+    with open(file, 'r') as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                edits.append(Edit.parse(line))
+            except ValueError as e:
+                raise ValueError(f'{file}:{number}: {e}')
+    return edits
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Set or change fields of the lines matching OSC path '
+                    'globs in many scenes at once. An edit reads PATH '
+                    '[strip=GLOB] FIELD=VALUE ..., e.g. "/ch/*/mix/13 '
+                    'strip=IEM* level+=3" or "/ch/*/eq/? 2=1k97". strip= '
+                    'keeps to the strips of matching names. FIELD is a '
+                    'field number counting from 1 or a name like fader, '
+                    'level, trim, hpf, f, g, name or color; += and -= '
+                    'change dB and frequency values.')
+    parser.add_argument('scenes', nargs='+', metavar='scene')
+    parser.add_argument('-f', '--file', action='append', default=[],
+                        help='a file of edits, one per line')
+    parser.add_argument('-e', '--edit', action='append', default=[],
+                        help='an edit')
+    parser.add_argument('-o', '--output', metavar='DIR',
+                        help='write the edited scenes to DIR instead of '
+                             'changing them in place')
+    parser.add_argument('--profile', metavar='FILE',
+                        help='save the time of every scene as json to FILE '
+                             'and print a summary')
+    args = parser.parse_args()
+    try:
+        edits = [edit for file in args.file for edit in load_edits(file)]
+        edits.extend(Edit.parse(edit) for edit in args.edit)
+    except (OSError, ValueError) as e:
+        print(f'Error: {e}')
+        sys.exit(1)
+    if not edits:
+        print('Error: no edits given. Use -e or -f.')
+        sys.exit(1)
+    if args.output is not None:
+        os.makedirs(args.output, exist_ok=True)
+    profile = instrument.enable() if args.profile else None
+    bulk = BulkEdit(edits)
+    total = 0
+    failed = 0
+    try:
+        for file in args.scenes:
+            out_file = (file if args.output is None else
+                        os.path.join(args.output, os.path.basename(file)))
+            try:
+                changed = bulk.edit_file(file, out_file)
+            except (OSError, ValueError) as e:
+                print(f'Error: could not edit {file}: {e}')
+                failed += 1
+                continue
+            instrument.count('lines changed', changed)
+            print(f'{file}: {changed} lines changed.')
+            total += changed
+    finally:
+        if profile is not None:
+            profile.save(args.profile)
+            print(profile.summary())
+            print(f'Profile saved to {args.profile}.')
+    print(f'Changed {total} lines in {len(args.scenes) - failed} scenes.')
+    if failed:
+        print(f'{failed} of {len(args.scenes)} scenes failed and were left '
+              f'as they were.')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+import json
+import time
+import contextlib
+
+# the Profiler of this process, None while profiling is off
+_profiler = None
+_NO_PHASE = contextlib.nullcontext()
+
+
+class Profiler:
+    """Wall time of phases and totals of counters.
+
+    Phases are keyed by their name and labels, e.g. the base file and the
+    session they ran for. Counters are plain totals, e.g. bytes written.
+    """
+
+    def __init__(self):
+        # (name, ((label, value), ...)) -> [seconds, calls]
+        self.phases = {}
+        self.counters = {}
+
+    @contextlib.contextmanager
+    def phase(self, name, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            entry = self.phases.setdefault(key, [0.0, 0])
+            entry[0] += time.perf_counter() - start
+            entry[1] += 1
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def report(self):
+        """Return everything recorded, as json-compatible data."""
+        return {'phases': [{'phase': name, **dict(labels),
+                            'seconds': seconds, 'calls': calls}
+                           for (name, labels), (seconds, calls)
+                           in self.phases.items()],
+                'counters': dict(self.counters)}
+
+    def merge(self, report):
+        """Add a report of another Profiler, e.g. of a worker process."""
+        for entry in report['phases']:
+            entry = dict(entry)
+            name = entry.pop('phase')
+            seconds = entry.pop('seconds')
+            calls = entry.pop('calls')
+            key = (name, tuple(sorted(entry.items())))
+            total = self.phases.setdefault(key, [0.0, 0])
+            total[0] += seconds
+            total[1] += calls
+        for name, n in report['counters'].items():
+            self.count(name, n)
+
+    def summary(self):
+        """Return a table of the total time of every phase name and all
+        counters."""
+        totals = {}
+        for (name, _), (seconds, calls) in self.phases.items():
+            total = totals.setdefault(name, [0.0, 0])
+            total[0] += seconds
+            total[1] += calls
+        rows = [f'{"phase":<24} {"calls":>7} {"seconds":>10}']
+        rows.extend(f'{name:<24} {calls:>7} {seconds:>10.4f}'
+                    for name, (seconds, calls) in sorted(
+                        totals.items(), key=lambda item: -item[1][0]))
+        if self.counters:
+            rows.append(f'{"counter":<24} {"total":>18}')
+            rows.extend(f'{name:<24} {n:>18}'
+                        for name, n in sorted(self.counters.items()))
+        return '\n'.join(rows)
+
+    def save(self, file):
+        with open(file, 'w') as f:
+            json.dump(self.report(), f, indent=1)
+
+
+def enable():
+    """Start profiling this process. Returns its Profiler."""
+    global _profiler
+    if _profiler is None:
+        _profiler = Profiler()
+    return _profiler
+
+
+def enabled():
+    return _profiler is not None
+
+
+def phase(name, **labels):
+    """Time the with block as phase name, if profiling is on."""
+    if _profiler is None:
+        return _NO_PHASE
+    return _profiler.phase(name, **labels)
+
+
+def count(name, n=1):
+    """Add n to counter name, if profiling is on."""
+    if _profiler is not None:
+        _profiler.count(name, n)
+
+
+def collect():
+    """Return the report recorded so far and start a new one. Used by
+    worker processes to hand their records to the parent."""
+    global _profiler
+    if _profiler is None:
+        return None
+    report = _profiler.report()
+    _profiler = Profiler()
+    return report
@@ -3,14 +3,17 @@
 import re
 import os
 import sys
-import fileinput
+import mmap
+import json
 import shutil
 
-import pandas as pd
-
 import primitives
+import instrument
 
 MAX_NAME_LEN = 20
+PROJECT_DATA = os.path.join('Alternatives', '000', 'ProjectData')
+# linux ioctl to share the extents of a file (copy-on-write clone)
+FICLONE = 0x40049409
 
 
 def replace_ascii(string, old, new):
@@ -23,108 +26,263 @@ def replace_ascii(string, old, new):
     return re.sub(old_hex_encode, new_hex_encode, string)
 
 
+def _compile_names(names):
+    """Compile one byte pattern that finds any of names in a single pass.
+
+    The match also covers the run of ``_`` padding the name in the project
+    file. Longer names come first, so the longest name wins at a position."""
+    alternatives = sorted((re.escape(name.encode()) for name in names),
+                          key=len, reverse=True)
+    return re.compile(b'(?P<name>' + b'|'.join(alternatives) + b')_*')
+
+
+def index_names(data, names):
+    """Return where names occur in data, found in a single pass.
+
+    The index maps every name to a list of ``(offset, length)`` of its
+    occurences, where ``length`` includes the ``_`` padding."""
+    index = {name: [] for name in names}
+    if not index:
+        return index
+    matches = 0
+    for m in _compile_names(names).finditer(data):
+        index[m.group('name').decode()].append(
+            (m.start(), m.end() - m.start()))
+        matches += 1
+    instrument.count('bytes scanned', len(data))
+    instrument.count('regex matches', matches)
+    return index
+
+
+def patch_names(buf, index, rename_dict):
+    """Write the names of rename_dict into buf at the offsets of index."""
+    for name, new_name in rename_dict.items():
+        new_name = new_name.encode()
+        for offset, length in index.get(name, ()):
+            buf[offset:offset + length] = new_name[:length].ljust(length,
+                                                                 b'\x20')
+
+
 def rename_in_file(file, rename_dict):
     """Rename all occurences of rename_dict.keys() with .values()
 
-    Acts on the file ``file`` in-place. Writes in binary mode.
+    Acts on the file ``file`` in-place. The file is memory-mapped and
+    searched once for all names; every occurence is patched in place.
 
-    Trailing ``_`` are replaced with spaces for each replacement.
+    Trailing ``_`` are replaced with spaces for each replacement. A new
+    name never grows past the padded name it replaces.
 
     INPUTS
         string file: existing file.
         dict(string old: string new): what to replace."""
-    # the block size to read at once
-    SEARCH_BLOCK_SIZE = 1024 * 16
-    with open(file, 'r+b') as f:
-        while True:
-            block = f.read(SEARCH_BLOCK_SIZE)
-            if block == b'':
-                break
-            actual_read = len(block)
-            for name, new_name in rename_dict.items():
-                # search for the name until it can't be found anymore
-                # we start to search at the block's start
-                offset = 0
-                # the last length of batch written to the file
-                last_len = 0
-                while True:
-                    # only look after the last offset.
-                    find_offset = block[offset + last_len:].find(name.encode())
-                    # name can not be found
-                    if find_offset == -1:
-                        break
-                    else:
-                        # the actual offset from the fp is shifted by its
-                        # last value (from last occurance of this name)
-                        # it is additionally shifted by last_len, because we
-                        # started the find last_len later to avoid circles
-                        offset += find_offset + last_len
-                        # save the current location
-                        current_pos = f.tell()
-                        # go to the location and replace
-                        # we need to write one block earlier, but offset later
-                        f.seek(offset - actual_read, 1)
-                        # write the new name, then spaces to clean up
-                        # rests of former names
-                        overhang = max(len(name) - len(new_name), 0)
-                        f.write(new_name.encode() +
-                                b'\x20' * overhang)
-                        # remove underscores from the end, replace w/ spaces:
-                        char = b'\x5f'
-                        i = 0
-                        # if char is an underscore
-                        while char == b'\x5f':
-                            # write a space
-                            f.write(b'\x20')
-                            # increment the counter for last_len
-                            i += 1
-                            # read one char
-                            char = f.read(1)
-                            # and seek back to the same char we just read
-                            f.seek(-1, 1)
-                        last_len = len(new_name.encode()) + overhang + i
-                        # go back to end of block for next occurance of name
-                        f.seek(current_pos)
-
-
-def create_named_projects(file, target_dir=None, csv_file=None):
+    if not rename_dict or os.path.getsize(file) == 0:
+        return
+    with open(file, 'r+b') as f, mmap.mmap(f.fileno(), 0) as mm:
+        patch_names(mm, index_names(mm, rename_dict), rename_dict)
+
+
+def _project_names(rename_dict):
+    """Convert a base name -> new name dict to the names in ProjectData."""
+    # all names must end on '__' for unambiguity in the project file
+    rename_dict = {k + '__': v if v != '' else '____EMPTY____'
+                   for k, v in rename_dict.items() if len(k) > 0}
+    # force the new names to be shorter then MAX_NAME_LEN
+    return {k: v[:MAX_NAME_LEN] for k, v in rename_dict.items()}
+
+
+def _reflink(src, dst):
+    """Clone src to dst with the FICLONE ioctl. Returns False if the
+    platform or filesystem does not support it."""
+    try:
+        import fcntl
+    except ImportError:
+        return False
+    try:
+        with open(src, 'rb') as s, open(dst, 'wb') as d:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+    except OSError:
+        if os.path.exists(dst):
+            os.remove(dst)
+        return False
+    shutil.copystat(src, dst)
+    return True
+
+
+def clone_file(src, dst, mode='reflink'):
+    """Copy src to dst, sharing the data with src where possible.
+
+    mode ``reflink`` tries a copy-on-write clone, ``link`` additionally
+    falls back to a hard link, ``copy`` always copies. Everything falls
+    back to a plain copy if the filesystem supports nothing better.
+
+    A hard link shares the file with src: editing dst in place also
+    changes src, so ``link`` is only safe for outputs nobody edits."""
+    if mode in ('link', 'reflink') and _reflink(src, dst):
+        instrument.count('files reflinked')
+        return dst
+    if mode == 'link':
+        try:
+            os.link(src, dst)
+            instrument.count('files linked')
+            return dst
+        except OSError:
+            pass
+    instrument.count('files copied')
+    instrument.count('bytes written', os.path.getsize(src))
+    return shutil.copy2(src, dst)
+
+
+def _index_cache_file(file):
+    file = file.rstrip(os.sep)
+    return os.path.join(os.path.dirname(file),
+                        f'.{os.path.basename(file)}.index.json')
+
+
+def load_index(file, names, data=None):
+    """Return the index of names in the ProjectData of the project file.
+
+    The index is cached next to the project and rebuilt when ProjectData
+    changes (by mtime and size) or a different set of names is asked for.
+    data may hold the content of ProjectData if it was already read."""
+    project_data = os.path.join(file, PROJECT_DATA)
+    stat = os.stat(project_data)
+    key = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size,
+           'names': sorted(names)}
+    cache_file = _index_cache_file(file)
+    try:
+        with open(cache_file, 'r') as f:
+            cache = json.load(f)
+        if cache['key'] == key:
+            instrument.count('index cache hits')
+            return {name: [tuple(occurence) for occurence in occurences]
+                    for name, occurences in cache['index'].items()}
+    except (OSError, ValueError, KeyError):
+        pass
+    instrument.count('index cache misses')
+    if data is None:
+        with open(project_data, 'rb') as f:
+            data = f.read()
+    index = index_names(data, names)
+    # write and rename, so concurrent builds never read half a cache
+    tmp_file = f'{cache_file}.{os.getpid()}'
+    try:
+        with open(tmp_file, 'w') as f:
+            json.dump({'key': key, 'index': index}, f)
+        os.replace(tmp_file, cache_file)
+    except OSError:
+        pass
+    return index
+
+
+class ProjectTemplate:
+    """A Logic project compiled once for creating many renamed copies.
+
+    The ProjectData of the base project is read and indexed once for all
+    names of the patch sheet. Every copy is then produced by patching the
+    known offsets, without searching the file again.
+    """
+
+    def __init__(self, file, names):
+        m = re.match(r'(?P<base>.*)\.logicx', file)
+        if m is None:
+            raise ValueError(f'{file} has no logic project name.')
+        self.file = file
+        self.base_name = os.path.basename(m.group('base'))
+        with open(os.path.join(file, PROJECT_DATA), 'rb') as f:
+            self._data = f.read()
+        instrument.count('bytes read', len(self._data))
+        self.index = load_index(file,
+                                _project_names({n: '' for n in names}),
+                                self._data)
+
+    def missing(self):
+        """Return the names that do not occur in the project."""
+        return [name[:-2] for name, occurences in self.index.items()
+                if not occurences]
+
+    def _ignore_project_data(self, directory, names):
+        if os.path.samefile(directory,
+                            os.path.join(self.file,
+                                         os.path.dirname(PROJECT_DATA))):
+            return {os.path.basename(PROJECT_DATA)}
+        return set()
+
+    def patched_data(self, rename_dict):
+        """Return the ProjectData of the copy renamed by rename_dict."""
+        data = bytearray(self._data)
+        patch_names(data, self.index, _project_names(rename_dict))
+        return data
+
+    def members(self):
+        """Return (path in the bundle, path) of every file of the bundle
+        except ProjectData, in a fixed order."""
+        members = []
+        for root, dirs, files in os.walk(self.file):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                rel_path = os.path.relpath(path, self.file)
+                if rel_path != os.path.normpath(PROJECT_DATA):
+                    members.append((rel_path, path))
+        return members
+
+    def project_name(self, session_name):
+        return f'{self.base_name}_{session_name}.logicx'
+
+    def render(self, session_name, rename_dict, target_dir,
+               clone='reflink'):
+        """Create the project for session_name in target_dir.
+
+        Only ProjectData is written as a real copy, all other files of the
+        bundle are cloned according to clone (see clone_file). Names of
+        rename_dict that the template was not compiled for are ignored.
+        Returns the path of the new project or None if it already exists."""
+        new_file_name = os.path.join(target_dir,
+                                     self.project_name(session_name))
+        try:
+            new_file = shutil.copytree(
+                self.file, new_file_name,
+                ignore=self._ignore_project_data,
+                copy_function=lambda src, dst: clone_file(src, dst, clone))
+        except FileExistsError:
+            print(
+                (f'The file {new_file_name} already exists.'))
+            return
+        with open(os.path.join(new_file, PROJECT_DATA), 'wb') as f:
+            f.write(self.patched_data(rename_dict))
+            instrument.count('bytes written', f.tell())
+        shutil.copymode(os.path.join(self.file, PROJECT_DATA),
+                        os.path.join(new_file, PROJECT_DATA))
+        return new_file
+
+
+def create_named_projects(file, target_dir=None, csv_file=None,
+                          strict=False, clone='reflink'):
     if target_dir is None:
         target_dir = input('Specify a target directory.\n')
     if not os.path.exists(target_dir):
         os.mkdir(target_dir)
     elif not os.path.isdir(target_dir):
         print(f'Error: {target_dir} is a file.')
-    df = primitives._get_name_df(csv_file=csv_file)
-    if df is None:
+    sheet = primitives._get_name_sheet(csv_file=csv_file)
+    if sheet is None:
+        return
+    try:
+        template = ProjectTemplate(file, primitives.base_names(sheet))
+    except ValueError as e:
+        print(f'Error: {e}')
         return
+    missing = template.missing()
+    if missing:
+        print(f'{"Error" if strict else "Warning"}: '
+              f'names not found in {file}: {", ".join(missing)}')
+        if strict:
+            return
     count = 0
-    m = re.match(r'(?P<base>.*)\.logicx', file)
-    if m is None:
-        print('File has no logic project name.')
-    base_name = m.group('base')
-    base_name = os.path.basename(base_name)
-    for session_name in df.columns:
-        if session_name.startswith('#'):
-            continue
-        rename_dict = {row[0]: row[1][session_name] for row in df.iterrows()}
-        # all names must end on '__' for unambiguity in the project file
-        rename_dict = {k + '__': v if v != '' else '____EMPTY____'
-                       for k, v in rename_dict.items() if len(k) > 0}
-        # force the new names to be shorter then MAX_NAME_LEN
-        rename_dict = {k: v[:MAX_NAME_LEN] for k, v in rename_dict.items()}
-        new_file_name = os.path.join(target_dir,
-                                     f'{base_name}_{session_name}.logicx')
-        try:
-            new_file = shutil.copytree(
-                file,
-                new_file_name)
-        except FileExistsError:
-            print(
-                (f'The file {new_file_name} already exists.'))
-            continue
-        rename_in_file(os.path.join(new_file, 'Alternatives/000/ProjectData'),
-                       rename_dict)
-        count += 1
+    for session_name, rename_dict in sheet.items():
+        if template.render(session_name, rename_dict, target_dir,
+                           clone=clone) is not None:
+            count += 1
     print(f'Logic rename done for {file}. '
           f'Created {count} new projects in {target_dir}.')
 
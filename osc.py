@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+
+import time
+import asyncio
+import struct
+import socket
+import threading
+
+from scene import Scene
+
+# the UDP port an X32 listens on for OSC
+X32_PORT = 10023
+
+# the largest bundle sent in one UDP packet, in bytes
+MAX_BUNDLE = 1024
+
+# OSC timetag meaning "immediately"
+IMMEDIATE = b'\0\0\0\0\0\0\0\1'
+
+# the answer of a path the console did not answer
+_NO_ANSWER = object()
+
+
+def _pad(data):
+    """Null-terminate data and pad it to a multiple of 4 bytes."""
+    return data + b'\0' * (4 - len(data) % 4)
+
+
+def encode_message(address, *args):
+    """Return an OSC message. args may be str, int or float."""
+    tags = ','
+    payload = b''
+    for arg in args:
+        if isinstance(arg, str):
+            tags += 's'
+            payload += _pad(arg.encode())
+        elif isinstance(arg, int):
+            tags += 'i'
+            payload += struct.pack('>i', arg)
+        elif isinstance(arg, float):
+            tags += 'f'
+            payload += struct.pack('>f', arg)
+        else:
+            raise TypeError(f'cannot send {arg!r} over OSC')
+    return _pad(address.encode()) + _pad(tags.encode()) + payload
+
+
+def encode_bundle(messages):
+    """Return an OSC bundle of encoded messages, to be run immediately."""
+    return b'#bundle\0' + IMMEDIATE + b''.join(
+        struct.pack('>i', len(message)) + message for message in messages)
+
+
+def _read_string(data, offset):
+    end = data.index(b'\0', offset)
+    return data[offset:end].decode(), (end // 4 + 1) * 4
+
+
+def decode_message(data):
+    """Return (address, [args]) of an OSC message."""
+    address, offset = _read_string(data, 0)
+    if offset >= len(data):
+        return address, []
+    tags, offset = _read_string(data, offset)
+    args = []
+    for tag in tags[1:]:
+        if tag == 's':
+            arg, offset = _read_string(data, offset)
+        elif tag == 'i':
+            arg, = struct.unpack_from('>i', data, offset)
+            offset += 4
+        elif tag == 'f':
+            arg, = struct.unpack_from('>f', data, offset)
+            offset += 4
+        else:
+            raise ValueError(f'unsupported OSC type tag {tag}')
+        args.append(arg)
+    return address, args
+
+
+def decode_packet(data):
+    """Return all (address, [args]) of an OSC message or bundle."""
+    if not data.startswith(b'#bundle\0'):
+        return [decode_message(data)]
+    messages = []
+    offset = 16
+    while offset < len(data):
+        size, = struct.unpack_from('>i', data, offset)
+        messages.extend(decode_packet(data[offset + 4:offset + 4 + size]))
+        offset += 4 + size
+    return messages
+
+
+def _normalized(args):
+    return ' '.join((args or '').split())
+
+
+def _node_reply(address, args):
+    """Return (path, args) of a /node reply, or None for other messages."""
+    if address.lstrip('/') != 'node' or not args:
+        return None
+    path, sep, value = str(args[0]).rstrip('\n').partition(' ')
+    return path, value if sep else None
+
+
+def scene_changes(old, new):
+    """Return the lines of new that differ from old, as path -> args.
+
+    Lines only in old cannot be removed from a console and are left out,
+    as is the header line."""
+    return {path: args for path, args in new.items()
+            if not path.startswith('#') and old.get(path) != args}
+
+
+class X32Client:
+    """Sends scene lines to an X32 over OSC.
+
+    Every line is sent as the X32 ``/`` command, which takes a line in the
+    format of a .scn file. Lines are grouped into bundles of at most
+    MAX_BUNDLE bytes and sent interval seconds apart. Afterwards every line
+    is read back with ``/node`` and the lines the console does not report
+    as sent are sent again, up to retries times.
+    """
+
+    def __init__(self, host, port=X32_PORT, timeout=0.2, retries=3,
+                 interval=0.002):
+        self.address = (host, port)
+        self.timeout = timeout
+        self.retries = retries
+        self.interval = interval
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.settimeout(timeout)
+
+    def close(self):
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _send_paced(self, packets):
+        for i, packet in enumerate(packets):
+            if i:
+                time.sleep(self.interval)
+            self.sock.sendto(packet, self.address)
+
+    def _bundles(self, changes):
+        bundles = []
+        messages = []
+        size = 16
+        for path, args in changes.items():
+            line = path if args is None else f'{path} {args}'
+            message = encode_message('/', line)
+            if messages and size + 4 + len(message) > MAX_BUNDLE:
+                bundles.append(encode_bundle(messages))
+                messages = []
+                size = 16
+            messages.append(message)
+            size += 4 + len(message)
+        if messages:
+            bundles.append(encode_bundle(messages))
+        return bundles
+
+    def query(self, paths):
+        """Read paths from the console. Returns path -> args of all paths
+        that were answered within the timeout."""
+        paths = set(paths)
+        self._send_paced([encode_message('/node', path.lstrip('/'))
+                          for path in paths])
+        answers = {}
+        deadline = time.monotonic() + self.timeout
+        while len(answers) < len(paths):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self.sock.settimeout(remaining)
+            try:
+                data, _ = self.sock.recvfrom(65536)
+            except socket.timeout:
+                break
+            for address, args in decode_packet(data):
+                reply = _node_reply(address, args)
+                if reply is not None and reply[0] in paths:
+                    answers[reply[0]] = reply[1]
+        return answers
+
+    def push(self, changes):
+        """Send changes (path -> args) to the console.
+
+        Returns the paths that were still not acknowledged after all
+        retries."""
+        pending = dict(changes)
+        for _ in range(self.retries + 1):
+            if not pending:
+                break
+            self._send_paced(self._bundles(pending))
+            answers = self.query(pending)
+            pending = {path: args for path, args in pending.items()
+                       if _normalized(answers.get(path)) != _normalized(args)}
+        return list(pending)
+
+
+class _NodeProtocol(asyncio.DatagramProtocol):
+    """Hands /node replies to the futures waiting for their path."""
+
+    def __init__(self):
+        self.transport = None
+        # path -> future of its args
+        self.waiting = {}
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        try:
+            messages = decode_packet(data)
+        except (ValueError, struct.error, UnicodeDecodeError):
+            return
+        for address, args in messages:
+            reply = _node_reply(address, args)
+            if reply is None:
+                continue
+            future = self.waiting.pop(reply[0], None)
+            if future is not None and not future.done():
+                future.set_result(reply[1])
+
+
+async def _query_path(protocol, limit, path, timeout, retries):
+    async with limit:
+        for _ in range(retries + 1):
+            future = asyncio.get_running_loop().create_future()
+            protocol.waiting[path] = future
+            protocol.transport.sendto(
+                encode_message('/node', path.lstrip('/')))
+            try:
+                return await asyncio.wait_for(future, timeout)
+            except asyncio.TimeoutError:
+                protocol.waiting.pop(path, None)
+        return _NO_ANSWER
+
+
+async def query_async(host, paths, port=X32_PORT, concurrency=64,
+                      timeout=0.2, retries=3):
+    """Read paths from the console with up to concurrency queries in
+    flight. Every path times out and is retried on its own.
+
+    Returns path -> args of all paths that were answered."""
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.create_datagram_endpoint(
+        _NodeProtocol, remote_addr=(host, port))
+    try:
+        limit = asyncio.Semaphore(concurrency)
+        paths = list(paths)
+        answers = await asyncio.gather(
+            *(_query_path(protocol, limit, path, timeout, retries)
+              for path in paths))
+    finally:
+        transport.close()
+    return {path: args for path, args in zip(paths, answers)
+            if args is not _NO_ANSWER}
+
+
+def pull_scene(template, host, port=X32_PORT, concurrency=64, timeout=0.2,
+               retries=3):
+    """Read the state of a console into a copy of template.
+
+    template gives the paths to read and their order, e.g. any scene saved
+    by the same firmware. Returns (scene, paths the console did not
+    answer); those keep the line of template."""
+    paths = [path for path in template if not path.startswith('#')]
+    answers = asyncio.run(query_async(host, paths, port=port,
+                                      concurrency=concurrency,
+                                      timeout=timeout, retries=retries))
+    scene = template.copy()
+    for path, args in answers.items():
+        scene[path] = args
+    return scene, [path for path in paths if path not in answers]
+
+
+class X32Emulator:
+    """A local stand-in for an X32, for testing pushes.
+
+    Listens on a UDP port of localhost in a background thread, applies
+    ``/`` lines to its own Scene, answers ``/node`` queries and records
+    every packet it receives. The first drop packets are ignored, to
+    simulate packet loss."""
+
+    def __init__(self, scene=None, drop=0):
+        self.scene = scene if scene is not None else Scene()
+        self.drop = drop
+        self.packets = []
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.port = self.sock.getsockname()[1]
+        self.sock.settimeout(0.05)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def _serve(self):
+        while not self._stop.is_set():
+            try:
+                data, sender = self.sock.recvfrom(65536)
+            except socket.timeout:
+                continue
+            self.packets.append(data)
+            if self.drop:
+                self.drop -= 1
+                continue
+            for address, args in decode_packet(data):
+                if address == '/' and args:
+                    path, sep, value = str(args[0]).partition(' ')
+                    self.scene[path] = value if sep else None
+                elif address == '/node' and args:
+                    path = '/' + str(args[0]).lstrip('/')
+                    if path in self.scene:
+                        value = self.scene[path]
+                        line = path if value is None else f'{path} {value}'
+                        self.sock.sendto(
+                            encode_message('node', line + '\n'), sender)
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
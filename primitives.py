@@ -3,13 +3,139 @@
 import os
 import csv
 import re
+import fnmatch
 
-import pandas as pd
+import instrument
 
 
-CHANNEL_RE = re.compile(r'/(?P<type>.*?)/(?P<ch_num>\d\d)/config '
+CHANNEL_RE = re.compile(r'/(?P<type>.*?)/(?P<ch_num>\d+|st|m)/config '
                         r'"(?P<name>.*)" '
-                        r'(?P<pic_num>\d+) (?P<color>.*)( (?P<input>\d+))?')
+                        r'(?P<pic_num>\d+) (?P<color>\S+)( (?P<input>\d+))?')
+
+# the prefix of a path of any strip: ch, auxin, fxrtn, bus, mtx, dca and
+# main, e.g. /ch/01 or /main/st
+_ANY_STRIP = (r'/(?P<type>ch|auxin|fxrtn|bus|mtx|dca|main)/'
+              r'(?P<ch_num>\d+|st|m)(?=/|$)')
+# the config line of any strip
+STRIP_CONFIG_RE = re.compile(_ANY_STRIP + r'/config$')
+# a path of any strip and its section, e.g. /ch/01/eq/2 -> ch 01 eq
+STRIP_SECTION_RE = re.compile(_ANY_STRIP + r'(?:/(?P<section>[^/]+))?')
+# a field of a scene line: a quoted string or a word
+FIELD_RE = re.compile(r'"[^"]*"|\S+')
+CONFIG_NAME_RE = re.compile(r'"(?P<name>.*?)"')
+# the strip prefix of any path, e.g. /ch/01/... or /bus/12/...
+STRIP_PATH_RE = re.compile(r'/(?P<type>ch|auxin|fxrtn|bus|mtx|dca)/'
+                           r'(?P<ch_num>\d+)(?=/|$)')
+# a send of a strip to a bus (ch, auxin, fxrtn) or a matrix (bus, main)
+SEND_RE = re.compile(r'/(?P<type>ch|auxin|fxrtn|bus|main)/(?P<ch_num>\w+)'
+                     r'/mix/(?P<slot>\d\d)$')
+# the source of an output, e.g. /outputs/main/01 or /outputs/p16/12
+OUTPUT_RE = re.compile(r'/outputs/\w+/\d+$')
+# the label of every strip type, in the order x32_toolkit shows them
+STRIP_LABELS = {'ch': 'CH', 'auxin': 'AUX', 'fxrtn': 'FXR', 'bus': 'BUS',
+                'mtx': 'MTX', 'main': 'MAIN', 'dca': 'DCA'}
+# the number of strips of every movable strip type
+STRIP_COUNTS = {'ch': 32, 'auxin': 8, 'fxrtn': 8, 'bus': 16, 'mtx': 6,
+                'dca': 8}
+
+
+def strip_number(strip_type, number):
+    """Return the number of a strip as it is written in its paths."""
+    if strip_type == 'dca':
+        return str(number)
+    return f'{number:0>2}'
+
+
+def renamed_config(m, new_name):
+    """Return the arguments of a config line matched by CHANNEL_RE
+    after renaming it to new_name.
+
+    An empty new_name also resets icon, colour and input."""
+    ch_type = m.group('type')
+    ch_pic_num = m.group('pic_num')
+    ch_color = m.group('color')
+    # only auxins and regular channels have an input
+    if ch_type == 'auxin' or ch_type == 'ch':
+        ch_input = f' {m.group("input")}'
+    else:
+        ch_input = ''
+    if new_name == '':
+        ch_pic_num = '1'
+        ch_color = 'OFF'
+        if ch_input:
+            ch_input = ' 0'
+    return f'"{new_name}" {ch_pic_num} {ch_color}{ch_input}'
+
+
+class RenameRules:
+    """A rename_dict (old name -> new name) compiled for matching names.
+
+    Most keys are exact names and are looked up in a dict. Two kinds of
+    keys are patterns:
+
+    - ``re:<regex>`` matches names with a regular expression. Its new name
+      may refer to groups of the expression, e.g. ``\\1``.
+    - ``glob:<glob>`` matches names with a shell-style glob, e.g.
+      ``glob:DRUM*``.
+
+    Any other key is an exact name, even if it contains ``*``, ``?`` or
+    ``[``. Exact names win over patterns, and the first matching pattern
+    wins over later ones. Raises ValueError naming the key of a pattern
+    that does not compile.
+    """
+
+    def __init__(self, rename_dict):
+        self.rename_dict = dict(rename_dict)
+        self.exact = {}
+        # [(key, regex, new name)] in the order of rename_dict
+        self.patterns = []
+        for key, new_name in self.rename_dict.items():
+            if key.startswith('re:'):
+                source = key[3:]
+            elif key.startswith('glob:'):
+                source = fnmatch.translate(key[5:])
+            else:
+                self.exact[key] = new_name
+                continue
+            try:
+                regex = re.compile(source)
+            except re.error as e:
+                raise ValueError(f'invalid pattern {key}: {e}') from None
+            self.patterns.append((key, regex, new_name))
+
+    def match(self, name):
+        """Return (key, new name) of the rule renaming name, or None."""
+        if name in self.exact:
+            return name, self.exact[name]
+        for key, regex, new_name in self.patterns:
+            m = regex.fullmatch(name)
+            if m is None:
+                continue
+            if key.startswith('re:'):
+                try:
+                    new_name = m.expand(new_name)
+                except re.error as e:
+                    raise ValueError(f'invalid new name {new_name} of '
+                                     f'{key}: {e}') from None
+            return key, new_name
+        return None
+
+
+class RenameReport:
+    """What a rename did: the renamed strips and the rules that matched
+    nothing."""
+
+    def __init__(self):
+        # [(strip type, strip number, old name, new name)]
+        self.applied = []
+        # [(key, new name)] of rules that matched no strip
+        self.missing = []
+
+    def __str__(self):
+        return '\n'.join(
+            [f'{ch_type.upper()} {ch_num}: {old} -> {new}'
+             for ch_type, ch_num, old, new in self.applied] +
+            [f'Failed to find {k} to {v}' for k, v in self.missing])
 
 
 def is_logicx(file_name):
@@ -20,7 +146,45 @@ def is_scn(file_name):
     return re.match(r'(?P<base>.*).scn', file_name)
 
 
-def _get_name_df(csv_file=None):
+def load_patch_sheet(csv_file):
+    """Read a patch sheet into ``{session: {base name: new name}}``.
+
+    The delimiter is the one of ``,``, ``;`` and tab occurring most often
+    in the header line. A column named
+    ``Base`` must exist. Columns starting with ``#`` and rows without a
+    Base name are skipped. The byte order mark of Excel's CSV UTF-8 export
+    is dropped. Returns None if there is no Base column."""
+    with instrument.phase('load csv'), \
+            open(csv_file, 'r', newline='', encoding='utf-8-sig') as f:
+        header_line = f.readline()
+        sep = max(',;\t', key=header_line.count)
+        f.seek(0)
+        reader = csv.reader(f, delimiter=sep)
+        header = next(reader, [])
+        if 'Base' not in header:
+            return
+        base = header.index('Base')
+        sessions = [(i, name) for i, name in enumerate(header)
+                    if i != base and not name.startswith('#')]
+        sheet = {name: {} for _, name in sessions}
+        for row in reader:
+            instrument.count('csv rows read')
+            if base >= len(row) or row[base] == '':
+                continue
+            for i, name in sessions:
+                sheet[name][row[base]] = row[i] if i < len(row) else ''
+    return sheet
+
+
+def base_names(sheet):
+    """Return the Base names of a patch sheet."""
+    names = {}
+    for rename_dict in sheet.values():
+        names.update(dict.fromkeys(rename_dict))
+    return list(names)
+
+
+def _get_name_sheet(csv_file=None):
     manualflag = False
     while True:
         if csv_file is None:
@@ -30,18 +194,13 @@ def _get_name_df(csv_file=None):
             file_name = csv_file
         if file_name == 'q':
             return
-        if not os.path.exists(csv_file):
-            print(f'Error: File {csv_file} does not exist.')
+        if not os.path.exists(file_name):
+            print(f'Error: File {file_name} does not exist.')
             if manualflag:
                 continue
+            return
         break
-    with open(file_name, 'r') as csvfile:
-        dialect = csv.Sniffer().sniff(csvfile.read(1024))
-        sep = dialect.delimiter
-    df = pd.read_csv(file_name, sep=sep)
-    if 'Base' not in df.columns:
+    sheet = load_patch_sheet(file_name)
+    if sheet is None:
         print('No Base Session exists. It must be named Base.')
-        return
-    df = df.fillna('')
-    df = df.set_index('Base')
-    return df
+    return sheet
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+
+import re
+import contextlib
+
+import primitives
+import instrument
+
+HEADER_RE = re.compile(r'"(?P<name>.*?)"(?P<post> .*)$')
+
+# the old value of a path that did not exist before a change
+_MISSING = object()
+
+
+class Scene:
+    """An X32 scene held in memory, indexed by OSC path.
+
+    A .scn file is parsed once by ``load`` and only written by ``export``.
+    Every line is kept as ``path -> args``, where ``args`` is everything
+    after the first space of the line, verbatim. The order of the paths
+    is the order of the file they were loaded from.
+    """
+
+    def __init__(self, lines=()):
+        # path -> args. dicts keep insertion order, which is the file order
+        self._args = {}
+        # path -> args before the running Journal.record, None if not recording
+        self._changes = None
+        # (strip type, strip number) -> name, built on first use
+        self._names = None
+        for line in lines:
+            line = line.rstrip('\r\n')
+            if line == '':
+                continue
+            path, sep, args = line.partition(' ')
+            self._args[path] = args if sep else None
+
+    @classmethod
+    def load(cls, file_name):
+        with instrument.phase('load scene'), open(file_name, 'r') as f:
+            scene = cls(f)
+            instrument.count('bytes read', f.tell())
+            instrument.count('scene lines read', len(scene))
+        return scene
+
+    def export(self, file_name):
+        with instrument.phase('write scene'), open(file_name, 'w') as f:
+            f.writelines(self.lines())
+            instrument.count('bytes written', f.tell())
+
+    def copy(self):
+        new = Scene()
+        new._args = dict(self._args)
+        if self._names is not None:
+            new._names = dict(self._names)
+        return new
+
+    def lines(self):
+        for path, args in self._args.items():
+            if args is None:
+                yield f'{path}\n'
+            else:
+                yield f'{path} {args}\n'
+
+    @property
+    def header(self):
+        """The path of the header line, e.g. ``#2.6#``."""
+        for path in self._args:
+            if path.startswith('#'):
+                return path
+        return None
+
+    @property
+    def name(self):
+        header = self.header
+        if header is None:
+            return None
+        m = HEADER_RE.match(self._args[header])
+        if m is None:
+            return None
+        return m.group('name')
+
+    @name.setter
+    def name(self, new_name):
+        header = self.header
+        if header is None:
+            return
+        m = HEADER_RE.match(self._args[header])
+        if m is None:
+            return
+        self[header] = f'"{new_name}"{m.group("post")}'
+
+    @property
+    def names(self):
+        """The names of all strips, as ``(type, number) -> name``.
+
+        The number is the string of the path, e.g. ``('ch', '01')`` or
+        ``('main', 'st')``. The index is built once and kept up to date by
+        every change of a config line."""
+        if self._names is None:
+            self._names = {}
+            for path in self._args:
+                self._index_name(path)
+        return self._names
+
+    def _index_name(self, path):
+        if not path.endswith('/config'):
+            return
+        m = primitives.STRIP_CONFIG_RE.match(path)
+        if m is None:
+            return
+        key = (m.group('type'), m.group('ch_num'))
+        m_name = primitives.CONFIG_NAME_RE.match(self._args.get(path) or '')
+        if m_name is None:
+            self._names.pop(key, None)
+        else:
+            self._names[key] = m_name.group('name')
+
+    def _store(self, path, args):
+        if args is _MISSING:
+            self._args.pop(path, None)
+        else:
+            self._args[path] = args
+        if self._names is not None:
+            self._index_name(path)
+
+    def __getitem__(self, path):
+        return self._args[path]
+
+    def __setitem__(self, path, args):
+        if self._changes is not None and path not in self._changes:
+            self._changes[path] = self._args.get(path, _MISSING)
+        self._store(path, args)
+
+    def __delitem__(self, path):
+        if self._changes is not None and path not in self._changes:
+            self._changes[path] = self._args.get(path, _MISSING)
+        if path not in self._args:
+            raise KeyError(path)
+        self._store(path, _MISSING)
+
+    def __contains__(self, path):
+        return path in self._args
+
+    def __iter__(self):
+        return iter(self._args)
+
+    def __len__(self):
+        return len(self._args)
+
+    def get(self, path, default=None):
+        return self._args.get(path, default)
+
+    def items(self):
+        return self._args.items()
+
+    def update(self, other):
+        for path, args in other.items():
+            self[path] = args
+
+
+class Journal:
+    """Undo and redo history of a Scene.
+
+    Every recorded command keeps only the lines it changed, as
+    ``path -> (old args, new args)``. Undoing or redoing a command costs
+    O(changed lines), no matter how large the scene is.
+    """
+
+    def __init__(self, scene):
+        self.scene = scene
+        # [(label, {path: (old, new)})]
+        self._undo = []
+        self._redo = []
+
+    @contextlib.contextmanager
+    def record(self, label):
+        """Record all changes to the scene inside the with block as one
+        command. Recording a command clears the redo history."""
+        self.scene._changes = {}
+        try:
+            yield
+        finally:
+            changes = self.scene._changes
+            self.scene._changes = None
+            delta = {}
+            for path, old in changes.items():
+                new = self.scene.get(path, _MISSING)
+                if old != new:
+                    delta[path] = (old, new)
+            if delta:
+                self._undo.append((label, delta))
+                self._redo.clear()
+
+    def _apply(self, delta, index):
+        for path, values in delta.items():
+            self.scene._store(path, values[index])
+
+    def undo(self):
+        """Undo the last command. Returns its label or None."""
+        if not self._undo:
+            return None
+        label, delta = self._undo.pop()
+        self._apply(delta, 0)
+        self._redo.append((label, delta))
+        return label
+
+    def redo(self):
+        """Redo the last undone command. Returns its label or None."""
+        if not self._redo:
+            return None
+        label, delta = self._redo.pop()
+        self._apply(delta, 1)
+        self._undo.append((label, delta))
+        return label
+
+    def __len__(self):
+        return len(self._undo)
+
+
+class SceneTemplate:
+    """A scene compiled once for rendering many renamed copies of it.
+
+    Compiling records where the header line and the config lines of the
+    renameable strip types sit, so that rendering a copy only substitutes
+    those lines and streams everything else unchanged. All strip types are
+    renameable if strip_types is None.
+    """
+
+    def __init__(self, scene, strip_types=None):
+        self._lines = list(scene.lines())
+        self._header = None
+        # current name -> [(line index, CHANNEL_RE match)]
+        self._configs = {}
+        for i, (path, args) in enumerate(scene.items()):
+            if path.startswith('#'):
+                m = HEADER_RE.match(args or '')
+                if m is not None and self._header is None:
+                    self._header = (i, path, m.group('post'))
+                continue
+            if not path.endswith('/config'):
+                continue
+            m = primitives.CHANNEL_RE.match(f'{path} {args}')
+            if m is None or (strip_types is not None
+                              and m.group('type') not in strip_types):
+                continue
+            self._configs.setdefault(m.group('name'), []).append((i, m))
+
+    def _substitutions(self, rename_dict, scene_name):
+        rules = primitives.RenameRules(rename_dict)
+        replaced = {}
+        matched = set()
+        for name, configs in self._configs.items():
+            rule = rules.match(name)
+            if rule is None:
+                continue
+            key, new_name = rule
+            matched.add(key)
+            for i, m in configs:
+                path = f'/{m.group("type")}/{m.group("ch_num")}/config'
+                args = primitives.renamed_config(m, new_name)
+                replaced[i] = f'{path} {args}\n'
+        if self._header is not None:
+            i, path, post = self._header
+            replaced[i] = f'{path} "{scene_name}"{post}\n'
+        instrument.count('names scanned', len(self._configs))
+        instrument.count('name matches', len(matched))
+        return replaced, [name for name in rename_dict if name not in matched]
+
+    def render(self, rename_dict, scene_name, out_file):
+        """Write the template to out_file, renamed by rename_dict.
+
+        Keys of rename_dict may be patterns, see primitives.RenameRules.
+        Returns the keys of rename_dict that match no name of the scene."""
+        replaced, failed = self._substitutions(rename_dict, scene_name)
+        with open(out_file, 'w') as f:
+            f.writelines(replaced.get(i, line)
+                         for i, line in enumerate(self._lines))
+            instrument.count('bytes written', f.tell())
+        return failed
+
+    def render_text(self, rename_dict, scene_name):
+        """Like render, but return (text of the scene, failed keys)."""
+        replaced, failed = self._substitutions(rename_dict, scene_name)
+        return ''.join(replaced.get(i, line)
+                       for i, line in enumerate(self._lines)), failed
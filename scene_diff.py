@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+
+import sys
+import argparse
+
+import primitives
+from scene import Scene
+
+# the args of a path that does not exist in a scene
+MISSING = object()
+
+
+def group_key(path):
+    """Return the (group, section) a path is shown under.
+
+    The group of a strip path is the strip, e.g. ('CH 01', 'eq'). Other
+    paths are grouped by their first two parts, e.g. ('OUTPUTS', 'main')."""
+    m = primitives.STRIP_SECTION_RE.match(path)
+    if m is not None:
+        label = primitives.STRIP_LABELS[m.group('type')]
+        return f'{label} {m.group("ch_num")}', m.group('section') or ''
+    if path.startswith('#'):
+        return ('HEADER', '')
+    parts = path.strip('/').split('/')
+    return (parts[0].upper(), parts[1] if len(parts) > 1 else '')
+
+
+def diff(old, new):
+    """Return the differences of two scenes, keyed by path.
+
+    Returns {(group, section): [(path, old args, new args)]} in the order
+    of the paths in new, followed by the paths only in old. Args of paths
+    missing from a scene are MISSING. The header line is left out."""
+    groups = {}
+    for path, args in new.items():
+        if path.startswith('#'):
+            continue
+        old_args = old.get(path, MISSING)
+        if old_args == args:
+            continue
+        groups.setdefault(group_key(path), []).append(
+            (path, old_args, args))
+    for path, args in old.items():
+        if not path.startswith('#') and path not in new:
+            groups.setdefault(group_key(path), []).append(
+                (path, args, MISSING))
+    return groups
+
+
+def _fields(args):
+    return [m for m in primitives.FIELD_RE.finditer(args)]
+
+
+def _merge_fields(base, ours, theirs):
+    """Merge the fields of three versions of one line.
+
+    Returns (merged args or None, [(field index, base, ours, theirs)]).
+    The merged args are None if the lines do not have the same fields."""
+    base_fields = _fields(base)
+    our_fields = _fields(ours)
+    their_fields = _fields(theirs)
+    if not len(base_fields) == len(our_fields) == len(their_fields):
+        return None, []
+    merged = ours
+    conflicts = []
+    # replace from the end, so the spans of earlier fields stay valid
+    for i in reversed(range(len(base_fields))):
+        b = base_fields[i].group()
+        o = our_fields[i].group()
+        t = their_fields[i].group()
+        if o == t or t == b:
+            continue
+        if o != b:
+            conflicts.append((i, b, o, t))
+            continue
+        start, end = our_fields[i].span()
+        merged = merged[:start] + t + merged[end:]
+    conflicts.reverse()
+    return merged, conflicts
+
+
+def merge(base, ours, theirs):
+    """Merge the changes of ours and theirs, both derived from base.
+
+    Lines are merged field by field, so a name changed on one side and a
+    colour changed on the other both arrive in the result. Where both
+    sides changed the same field differently, ours is kept.
+
+    Returns (merged scene, conflicts), conflicts as
+    [(path, field index, base, ours, theirs)] of the conflicting fields,
+    or of the whole lines with field index None."""
+    merged = Scene()
+    conflicts = []
+    # base order first, then the lines new in ours and then in theirs
+    for path in dict.fromkeys([*base, *ours, *theirs]):
+        b = base.get(path, MISSING)
+        o = ours.get(path, MISSING)
+        t = theirs.get(path, MISSING)
+        if path.startswith('#'):
+            args = b if o is MISSING else o
+        elif o == t or t == b:
+            args = o
+        elif o == b:
+            args = t
+        elif all(isinstance(args, str) for args in (b, o, t)):
+            args, field_conflicts = _merge_fields(b, o, t)
+            if args is None:
+                args = o
+                conflicts.append((path, None, b, o, t))
+            conflicts.extend((path, *c) for c in field_conflicts)
+        else:
+            args = o
+            conflicts.append((path, None, b, o, t))
+        if args is not MISSING:
+            merged[path] = args
+    return merged, conflicts
+
+
+def _show(args):
+    return '(missing)' if args is MISSING else args
+
+
+def print_diff(groups):
+    for (group, section), changes in groups.items():
+        print(f'{group} {section}'.rstrip())
+        for path, old, new in changes:
+            print(f'  {path}: {_show(old)} -> {_show(new)}')
+
+
+def print_conflicts(conflicts):
+    for path, field, base, ours, theirs in conflicts:
+        where = path if field is None else f'{path} field {field + 1}'
+        print(f'Conflict {where}: base {_show(base)}, ours {_show(ours)}, '
+              f'theirs {_show(theirs)}. Kept ours.')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compare X32 scenes by path, or merge two scenes '
+                    'derived from the same base.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    diff_parser = commands.add_parser(
+        'diff', help='show the changes from one scene to another')
+    diff_parser.add_argument('old')
+    diff_parser.add_argument('new')
+    merge_parser = commands.add_parser(
+        'merge', help='merge the changes of two scenes to their base')
+    merge_parser.add_argument('base')
+    merge_parser.add_argument('ours')
+    merge_parser.add_argument('theirs')
+    merge_parser.add_argument('-o', '--output', required=True)
+    args = parser.parse_args()
+    if args.command == 'diff':
+        groups = diff(Scene.load(args.old), Scene.load(args.new))
+        print_diff(groups)
+        print(f'{sum(len(c) for c in groups.values())} lines differ in '
+              f'{len(groups)} sections.')
+        return
+    ours = Scene.load(args.ours)
+    merged, conflicts = merge(Scene.load(args.base), ours,
+                              Scene.load(args.theirs))
+    merged.name = ours.name
+    merged.export(args.output)
+    print_conflicts(conflicts)
+    print(f'Done. Merged scene saved to {args.output} with '
+          f'{len(conflicts)} conflicts.')
+    if conflicts:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+import sqlite3
+import argparse
+
+import primitives
+from scene import HEADER_RE
+
+DEFAULT_DB = 'scene_index.sqlite'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    scene TEXT
+);
+CREATE TABLE IF NOT EXISTS strips (
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    type TEXT NOT NULL,
+    number TEXT NOT NULL,
+    name TEXT NOT NULL,
+    icon INTEGER,
+    color TEXT,
+    input INTEGER
+);
+CREATE INDEX IF NOT EXISTS strips_name ON strips(name);
+CREATE INDEX IF NOT EXISTS strips_type_number ON strips(type, number);
+CREATE INDEX IF NOT EXISTS strips_file ON strips(file_id);
+'''
+
+
+def connect(db_file):
+    db = sqlite3.connect(db_file)
+    db.execute('PRAGMA foreign_keys = ON')
+    db.executescript(SCHEMA)
+    return db
+
+
+def read_strips(file):
+    """Return (scene name, [(type, number, name, icon, color, input)]) of
+    a scene file, reading only its header and config lines."""
+    scene_name = None
+    strips = []
+    with open(file, 'r', errors='replace') as f:
+        for line in f:
+            if line.startswith('#'):
+                if scene_name is None:
+                    m = HEADER_RE.search(line.rstrip('\r\n'))
+                    if m is not None:
+                        scene_name = m.group('name')
+                continue
+            if '/config "' not in line:
+                continue
+            m = primitives.CHANNEL_RE.match(line)
+            if m is None:
+                continue
+            strips.append((m.group('type'), m.group('ch_num'),
+                           m.group('name'), int(m.group('pic_num')),
+                           m.group('color'),
+                           None if m.group('input') is None
+                           else int(m.group('input'))))
+    return scene_name, strips
+
+
+def update(db, root):
+    """Bring the index up to date with the scenes below root.
+
+    Only files whose modification time or size changed are read again;
+    files that no longer exist are dropped. Returns (files read, files
+    removed, files unchanged)."""
+    known = {path: (file_id, mtime_ns, size)
+             for file_id, path, mtime_ns, size
+             in db.execute('SELECT id, path, mtime_ns, size FROM files')}
+    root = os.path.abspath(root)
+    seen = set()
+    read = unchanged = 0
+    with db:
+        for dir_path, dirs, files in os.walk(root):
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            for name in files:
+                if not name.endswith('.scn') or name.startswith('.'):
+                    continue
+                path = os.path.join(dir_path, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                seen.add(path)
+                entry = known.get(path)
+                if entry is not None and entry[1:] == (stat.st_mtime_ns,
+                                                       stat.st_size):
+                    unchanged += 1
+                    continue
+                try:
+                    scene_name, strips = read_strips(path)
+                except OSError as e:
+                    print(f'Warning: could not read {path}: {e}')
+                    continue
+                if entry is not None:
+                    db.execute('DELETE FROM files WHERE id = ?', (entry[0],))
+                file_id = db.execute(
+                    'INSERT INTO files (path, mtime_ns, size, scene) '
+                    'VALUES (?, ?, ?, ?)',
+                    (path, stat.st_mtime_ns, stat.st_size,
+                     scene_name)).lastrowid
+                db.executemany(
+                    'INSERT INTO strips VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    [(file_id, *strip) for strip in strips])
+                read += 1
+        removed = [(file_id,) for path, (file_id, _, _) in known.items()
+                   if path not in seen and path.startswith(root + os.sep)]
+        db.executemany('DELETE FROM files WHERE id = ?', removed)
+    return read, len(removed), unchanged
+
+
+def _match(column, value):
+    """Return an SQL condition and its parameters. Values with * or ? are
+    globs."""
+    if any(c in value for c in '*?['):
+        return f'{column} GLOB ?', [value]
+    return f'{column} = ?', [value]
+
+
+def query(db, name=None, strip_type=None, number=None, scene=None,
+          color=None, limit=None):
+    """Return the strips matching all given conditions, newest scene
+    first, as (scene, path, mtime_ns, type, number, name, color, input)."""
+    conditions = []
+    params = []
+    for column, value in (('strips.name', name), ('strips.type', strip_type),
+                          ('files.scene', scene), ('strips.color', color)):
+        if value is not None:
+            condition, values = _match(column, value)
+            conditions.append(condition)
+            params.extend(values)
+    if number is not None:
+        # the number as written in the paths: 01 for channels, 1 for dcas
+        numbers = {number}
+        if number.isdigit():
+            numbers |= {str(int(number)), f'{int(number):0>2}'}
+        conditions.append(
+            f'strips.number IN ({", ".join("?" * len(numbers))})')
+        params.extend(sorted(numbers))
+    sql = ('SELECT files.scene, files.path, files.mtime_ns, strips.type, '
+           'strips.number, strips.name, strips.color, strips.input '
+           'FROM strips JOIN files ON files.id = strips.file_id')
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    sql += ' ORDER BY files.mtime_ns DESC, files.path, strips.rowid'
+    if limit is not None:
+        sql += ' LIMIT ?'
+        params.append(limit)
+    return db.execute(sql, params).fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Index the strips of an archive of X32 scenes and '
+                    'search them.')
+    parser.add_argument('--db', default=DEFAULT_DB,
+                        help=f'the index file (default: {DEFAULT_DB})')
+    commands = parser.add_subparsers(dest='command', required=True)
+    update_parser = commands.add_parser(
+        'update', help='index new and changed scenes below a directory')
+    update_parser.add_argument('root')
+    query_parser = commands.add_parser(
+        'query', help='find strips. Values may be globs like "IEM*"')
+    query_parser.add_argument('--name')
+    query_parser.add_argument('--type', dest='strip_type',
+                              choices=('ch', 'auxin', 'fxrtn', 'bus', 'mtx',
+                                       'dca', 'main'))
+    query_parser.add_argument('--number')
+    query_parser.add_argument('--scene', help='the name in the scene header')
+    query_parser.add_argument('--color')
+    query_parser.add_argument('--last', action='store_true',
+                              help='only the newest match')
+    args = parser.parse_args()
+    db = connect(args.db)
+    start = time.perf_counter()
+    if args.command == 'update':
+        if not os.path.isdir(args.root):
+            print(f'Error: {args.root} is not a directory.')
+            sys.exit(1)
+        read, removed, unchanged = update(db, args.root)
+        print(f'Indexed {read} scenes, removed {removed}, {unchanged} '
+              f'unchanged in {time.perf_counter() - start:.2f} s.')
+        return
+    rows = query(db, args.name, args.strip_type, args.number, args.scene,
+                 args.color, limit=1 if args.last else None)
+    for scene, path, mtime_ns, strip_type, number, name, color, input_ \
+            in rows:
+        date = time.strftime('%Y-%m-%d %H:%M',
+                             time.localtime(mtime_ns / 1e9))
+        print(f'{date}  {scene}  {strip_type.upper()} {number}  "{name}"  '
+              f'{color}  {"" if input_ is None else input_}  {path}')
+    print(f'{len(rows)} matches in '
+          f'{(time.perf_counter() - start) * 1000:.1f} ms.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+
+import json
+import argparse
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import api
+
+DEFAULT_PORT = 8732
+
+
+def _sheet(params):
+    """The patch sheet of a request: inline as 'sheet' or as 'csv'."""
+    if 'sheet' in params:
+        return params['sheet']
+    return api.load_sheet(params['csv'])
+
+
+def _rename_dict(params):
+    if 'rename' in params:
+        return params['rename']
+    return api.session_rename_dict(_sheet(params), params['session'])
+
+
+# job kind -> function running it on the params of the request
+JOBS = {
+    'rename_scene': lambda p: api.rename_scene(
+        p['scene'], _rename_dict(p), p.get('output'), p.get('strip_types')),
+    'move_strips': lambda p: api.move_strips(
+        p['scene'],
+        {strip_type: {int(k): int(v) for k, v in moves.items()}
+         for strip_type, moves in p['moves'].items()},
+        p.get('output')),
+    'create_scenes': lambda p: api.create_scenes(
+        p['scene'], _sheet(p), p['target_dir'], p.get('sessions')),
+    'create_projects': lambda p: api.create_projects(
+        p['project'], _sheet(p), p['target_dir'], p.get('sessions'),
+        p.get('clone', 'reflink'), p.get('strict', False)),
+    'build': lambda p: api.build(
+        p['csv'], p['base_dir'], p['target_dir'], p.get('sessions'),
+        p.get('clone', 'reflink'), p.get('strict', False)),
+}
+
+
+class JobQueue:
+    """Runs jobs on a pool of threads of this process, which keeps the
+    compiled templates of api.templates warm between jobs."""
+
+    def __init__(self, workers=4):
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        # job id -> {'kind', 'status', 'result', 'error'}
+        self.jobs = {}
+
+    def _run(self, job_id, kind, params):
+        job = self.jobs[job_id]
+        job['status'] = 'running'
+        try:
+            job['result'] = JOBS[kind](params)
+            job['status'] = 'done'
+        except KeyError as e:
+            job['error'] = f'missing parameter {e}'
+            job['status'] = 'failed'
+        except (OSError, ValueError, TypeError) as e:
+            job['error'] = str(e)
+            job['status'] = 'failed'
+        except Exception as e:
+            # a bug must not leave the job running forever
+            job['error'] = repr(e)
+            job['status'] = 'failed'
+
+    def submit(self, kind, params):
+        """Queue a job. Returns its id and the future of its run."""
+        if kind not in JOBS:
+            raise ValueError(f'unknown job {kind}')
+        with self._lock:
+            job_id = next(self._ids)
+            self.jobs[job_id] = {'id': job_id, 'kind': kind,
+                                 'status': 'queued', 'result': None,
+                                 'error': None}
+        return job_id, self._pool.submit(self._run, job_id, kind, params)
+
+    def shutdown(self):
+        self._pool.shutdown()
+
+
+class Handler(BaseHTTPRequestHandler):
+    """POST /jobs queues a job, GET /jobs/<id> reports it.
+
+    The body of a POST is a json object with the job kind in 'job' and
+    its parameters. With "wait": true the response is sent when the job
+    is done."""
+
+    queue = None
+
+    def _send(self, code, data):
+        body = json.dumps(data).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/jobs':
+            self._send(200, list(self.queue.jobs.values()))
+            return
+        prefix, _, job_id = self.path.rpartition('/')
+        if prefix != '/jobs' or not job_id.isdigit():
+            self._send(404, {'error': 'not found'})
+            return
+        job = self.queue.jobs.get(int(job_id))
+        if job is None:
+            self._send(404, {'error': f'no job {job_id}'})
+            return
+        self._send(200, job)
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/jobs':
+            self._send(404, {'error': 'not found'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            params = json.loads(self.rfile.read(length))
+            job_id, future = self.queue.submit(params.pop('job', None),
+                                               params)
+        except (ValueError, AttributeError) as e:
+            self._send(400, {'error': str(e)})
+            return
+        if params.get('wait'):
+            future.result()
+            self._send(200, self.queue.jobs[job_id])
+        else:
+            self._send(202, self.queue.jobs[job_id])
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(host='127.0.0.1', port=DEFAULT_PORT, workers=4):
+    """Run the job service until interrupted."""
+    queue = JobQueue(workers)
+    handler = type('BoundHandler', (Handler,), {'queue': queue})
+    with ThreadingHTTPServer((host, port), handler) as server:
+        print(f'Serving jobs on http://{host}:{server.server_port}/jobs.')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print('Stopped.')
+        finally:
+            queue.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Serve scene and project jobs over local HTTP from one '
+                    'warm process.')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+                        help=f'port to listen on (default: {DEFAULT_PORT})')
+    parser.add_argument('-j', '--jobs', type=int, default=4,
+                        help='jobs run at the same time (default: 4)')
+    args = parser.parse_args()
+    serve(args.host, args.port, args.jobs)
+
+
+if __name__ == '__main__':
+    main()
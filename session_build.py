@@ -2,29 +2,426 @@
 
 import sys
 import os
-import re
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import contextlib
+import collections
+from concurrent.futures import Future, ProcessPoolExecutor
 
 import x32_toolkit
 import logic_rename
 import primitives
+import instrument
+from archive import ArchiveWriter, archive_format
+from template_cache import templates, stat_key
 
 
-def main():
-    csv_file = sys.argv[1]
-    base_dir = sys.argv[2]
-    target_dir = sys.argv[3]
-    if target_dir[-1] == '/':
-        target_dir = target_dir[:-1]
-    for file in os.listdir(base_dir):
+# the manifest of a target directory, recording the inputs of every output
+MANIFEST = '.session_build.json'
+
+# the patch sheet of the running build, shared with every worker process
+_sheet = {}
+# the Base names of _sheet, the names Logic projects are compiled for
+_names = ()
+
+
+def _init_worker(sheet, profile=False):
+    global _sheet, _names
+    _sheet = sheet
+    _names = tuple(primitives.base_names(sheet))
+    if profile:
+        instrument.enable()
+        # drop the records a forked worker inherited from the parent
+        instrument.collect()
+
+
+def _inline_job(func, file, session_name, *args):
+    """Run one job in this process. Returns (result, None)."""
+    with instrument.phase('build', base=os.path.basename(file),
+                          session=session_name):
+        return func(file, session_name, *args), None
+
+
+def _job(func, file, session_name, *args):
+    """Run one job in a worker. Returns (result, profile report or None)."""
+    result, _ = _inline_job(func, file, session_name, *args)
+    return result, instrument.collect()
+
+
+class _InlineExecutor:
+    """Runs jobs in this process, for builds too small to start workers."""
+
+    def submit(self, fn, *args):
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+@contextlib.contextmanager
+def _executor(workers, job_count, profile=None, inline_jobs=1):
+    """Yield (executor, job function) for job_count jobs. Up to inline_jobs
+    jobs run in this process, with its warm templates."""
+    if workers <= 1 or job_count <= inline_jobs:
+        yield _InlineExecutor(), _inline_job
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(_sheet, profile is not None)) as pool:
+        yield pool, _job
+
+
+def _load_template(file):
+    return templates.scene(file)
+
+
+def _load_project(file):
+    return templates.project(file, _names)
+
+
+def build_output(file, session_name, target_dir, clone='reflink'):
+    """Build the output of one (base file, session) pair.
+
+    Runs in a worker process. The compiled templates are loaded once per
+    worker and reused for all of its jobs."""
+    rename_dict = _sheet[session_name]
+    if primitives.is_logicx(file):
+        return _load_project(file).render(session_name, rename_dict,
+                                          target_dir, clone=clone)
+    prefix = os.path.splitext(os.path.basename(file))[0]
+    return x32_toolkit.create_named_scene(_load_template(file), prefix,
+                                          session_name, rename_dict,
+                                          target_dir)
+
+
+def render_output(file, session_name):
+    """Render the output of one (base file, session) pair into memory.
+
+    Runs in a worker process. Returns the text of the scene, or the
+    ProjectData of the Logic project, as bytes."""
+    rename_dict = _sheet[session_name]
+    if primitives.is_logicx(file):
+        return bytes(_load_project(file).patched_data(rename_dict))
+    prefix = os.path.splitext(os.path.basename(file))[0]
+    text, _ = _load_template(file).render_text(rename_dict,
+                                               f'{prefix}_{session_name}')
+    return text.encode()
+
+
+def _write_output(archive, file, session_name, future, profile=None):
+    """Write the rendered output of a job into archive. Returns 1 if the
+    job failed, else 0."""
+    try:
+        data, report = future.result()
+        if report is not None:
+            profile.merge(report)
+    except Exception as e:
+        print(f'Error: Session {session_name} from {file} failed: {e!r}')
+        return 1
+    if not primitives.is_logicx(file):
+        archive.add_bytes(output_name(file, session_name), data)
+        return 0
+    template = _load_project(file)
+    project = template.project_name(session_name)
+    for rel_path, path in template.members():
+        archive.add_file(f'{project}/{rel_path}'.replace(os.sep, '/'),
+                         path, stored=True)
+    project_data = os.path.join(file, logic_rename.PROJECT_DATA)
+    archive.add_bytes(
+        f'{project}/{logic_rename.PROJECT_DATA}'.replace(os.sep, '/'),
+        data, mode=os.stat(project_data).st_mode & 0o777)
+    return 0
+
+
+def build_archive(jobs, archive_file, workers, profile=None):
+    """Build all jobs into the zip or tar archive archive_file.
+
+    The workers render every output into memory and this process writes
+    them into the archive in job order. At most two outputs per worker are
+    held in memory at a time. The reports of the workers are merged into
+    profile, if given. Returns the number of failed outputs."""
+    directory, name = os.path.split(archive_file)
+    # keep the extension, it tells ArchiveWriter the format
+    tmp_file = os.path.join(directory, f'.{name}')
+    in_flight = 2 * max(workers, 1)
+    # (file, session, future) of submitted jobs not yet written
+    pending = collections.deque()
+    failed = 0
+    with _executor(workers, len(jobs), profile) as (pool, job), \
+            ArchiveWriter(tmp_file) as archive:
+        for file, session_name in jobs:
+            pending.append((file, session_name,
+                            pool.submit(job, render_output, file,
+                                        session_name)))
+            if len(pending) >= in_flight:
+                failed += _write_output(archive, *pending.popleft(), profile)
+        while pending:
+            failed += _write_output(archive, *pending.popleft(), profile)
+    instrument.count('bytes written', os.path.getsize(tmp_file))
+    os.replace(tmp_file, archive_file)
+    return failed
+
+
+def output_name(file, session_name):
+    """Return the file name of the output of a (base file, session) pair."""
+    base, ext = os.path.splitext(os.path.basename(file.rstrip(os.sep)))
+    return f'{base}_{session_name}{ext}'
+
+
+def cached_hash_base(file):
+    """Like template_cache.hash_base, but only hash again if the files
+    changed."""
+    return templates.hash(file)
+
+
+def hash_names(rename_dict):
+    """Return a hash of the rename mapping of one session."""
+    return hashlib.sha256(
+        json.dumps(rename_dict, sort_keys=True).encode()).hexdigest()
+
+
+def load_manifest(target_dir):
+    try:
+        with open(os.path.join(target_dir, MANIFEST), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(target_dir, manifest):
+    manifest_file = os.path.join(target_dir, MANIFEST)
+    with open(manifest_file + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(manifest_file + '.tmp', manifest_file)
+
+
+def remove_output(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+def plan_jobs(sheet, base_dir, strict=False):
+    """Return all (base file, session) pairs to build, in a fixed order.
+
+    Names of the csv file missing from a Logic project are reported here,
+    before anything is built. With strict, they abort the build and None
+    is returned."""
+    jobs = []
+    missing = False
+    for file in sorted(os.listdir(base_dir)):
+        if file.startswith('.'):
+            continue
         file = os.path.join(base_dir, file)
         if primitives.is_logicx(file):
-            logic_rename.create_named_projects(file, target_dir, csv_file)
-        elif primitives.is_scn(file):
-            x32_toolkit.create_named_scenes(
-                wip_file=file, target_dir=target_dir,
-                csv_file=csv_file)
-        else:
+            names = _load_project(file).missing()
+            if names:
+                print(f'{"Error" if strict else "Warning"}: '
+                      f'names not found in {file}: {", ".join(names)}')
+                missing = True
+        elif not primitives.is_scn(file):
             print(f'Unknown file {file}. Skipped.')  # noqa
+            continue
+        jobs.extend((file, session_name) for session_name in sheet)
+    if strict and missing:
+        return None
+    return jobs
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Create Scenes and Projects for every Session in a csv '
+                    'file, using the files in a base directory as Template. '
+                    'If target_dir ends in .zip, .tar, .tar.gz, .tgz, '
+                    '.tar.bz2 or .tar.xz, everything is written into that '
+                    'archive instead.')
+    parser.add_argument('csv_file')
+    parser.add_argument('base_dir')
+    parser.add_argument('target_dir')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help='number of worker processes '
+                             '(default: number of cores)')
+    parser.add_argument('--clone', choices=('link', 'reflink', 'copy'),
+                        default='reflink',
+                        help='how unchanged files of Logic projects are '
+                             'copied: reflink, else a real copy (reflink), '
+                             'reflink, else hard link (link) or always a '
+                             'real copy (copy). Hard links share the files '
+                             'with base_dir, so a project edited in place '
+                             'also changes the base and every other '
+                             'Session (default: reflink)')
+    parser.add_argument('--strict', action='store_true',
+                        help='abort before building anything if a name of '
+                             'the csv file is missing from a Logic project')
+    parser.add_argument('--force', action='store_true',
+                        help='rebuild every output, even if its inputs did '
+                             'not change since the last build')
+    parser.add_argument('--profile', metavar='FILE',
+                        help='record the time of every phase per base file '
+                             'and Session and counters of the work done, '
+                             'save them as json to FILE and print a summary')
+    parser.add_argument('--watch', action='store_true',
+                        help='keep running and rebuild the affected outputs '
+                             'whenever the csv file or a base file changes')
+    parser.add_argument('--interval', type=float, default=0.25,
+                        help='seconds between two checks for changes in '
+                             '--watch mode (default: 0.25)')
+    args = parser.parse_args()
+    profile = instrument.enable() if args.profile else None
+    try:
+        if args.watch:
+            status = watch(args, profile)
+        else:
+            status = build(args, profile)
+    finally:
+        if profile is not None:
+            profile.save(args.profile)
+            print(profile.summary())
+            print(f'Profile saved to {args.profile}.')
+    sys.exit(status)
+
+
+def build(args, profile=None, force=None, inline_jobs=1):
+    """Build all outputs that are not up to date. Returns the exit status.
+
+    force overrides args.force. Up to inline_jobs outputs are built in this
+    process instead of in workers, see _executor."""
+    sheet = templates.sheet(args.csv_file)
+    if sheet is None:
+        print('No Base Session exists. It must be named Base.')
+        return 1
+    _init_worker(sheet)
+    with instrument.phase('plan'):
+        jobs = plan_jobs(sheet, args.base_dir, strict=args.strict)
+    if jobs is None:
+        return 1
+    if archive_format(args.target_dir) is not None:
+        with instrument.phase('write archive'):
+            failed = build_archive(jobs, args.target_dir, args.jobs,
+                                   profile)
+        print(f'Build done. Wrote {len(jobs) - failed} outputs to '
+              f'{args.target_dir}.')
+        if failed:
+            print(f'{failed} of {len(jobs)} outputs failed.')
+            return 1
+        return 0
+    if force is None:
+        force = args.force
+    os.makedirs(args.target_dir, exist_ok=True)
+    manifest = {} if force else load_manifest(args.target_dir)
+    base_hashes = {}
+    for file in dict.fromkeys(file for file, _ in jobs):
+        with instrument.phase('hash base', base=os.path.basename(file)):
+            base_hashes[file] = cached_hash_base(file)
+    new_manifest = {}
+    counts = {file: 0 for file in base_hashes}
+    up_to_date = {file: 0 for file in base_hashes}
+    todo = []
+    for file, session_name in jobs:
+        name = output_name(file, session_name)
+        entry = {'base': base_hashes[file],
+                 'names': hash_names(sheet[session_name])}
+        if (manifest.get(name) == entry
+                and os.path.exists(os.path.join(args.target_dir, name))):
+            new_manifest[name] = entry
+            up_to_date[file] += 1
+            continue
+        remove_output(os.path.join(args.target_dir, name))
+        todo.append((file, session_name, name, entry))
+    # outputs of sessions or base files that no longer exist
+    todo_names = {name for _, _, name, _ in todo}
+    removed = [name for name in manifest
+               if name not in new_manifest and name not in todo_names]
+    for name in removed:
+        remove_output(os.path.join(args.target_dir, name))
+    failed = 0
+    with _executor(args.jobs, len(todo), profile,
+                   inline_jobs) as (pool, job):
+        futures = [(file, session_name, name, entry,
+                    pool.submit(job, build_output, file, session_name,
+                                args.target_dir, args.clone))
+                   for file, session_name, name, entry in todo]
+        # collect in submission order, so the output does not depend on
+        # which worker finishes first
+        for file, session_name, name, entry, future in futures:
+            try:
+                result, report = future.result()
+                if report is not None:
+                    profile.merge(report)
+                if result is not None:
+                    counts[file] += 1
+                    new_manifest[name] = entry
+            except Exception as e:
+                print(f'Error: Session {session_name} from {file} failed: '
+                      f'{e!r}')
+                failed += 1
+    save_manifest(args.target_dir, new_manifest)
+    for file, count in counts.items():
+        print(f'Build done for {file}. Created {count} new files, '
+              f'{up_to_date[file]} up to date in {args.target_dir}.')
+    if removed:
+        print(f'Removed {len(removed)} outputs of deleted sessions.')
+    if failed:
+        print(f'{failed} of {len(todo)} outputs failed.')
+        return 1
+    return 0
+
+
+def watched_files(csv_file, base_dir):
+    """Return stat_key of the csv file and of every file in base_dir."""
+    files = {csv_file: stat_key(csv_file)}
+    for name in sorted(os.listdir(base_dir)):
+        if not name.startswith('.'):
+            path = os.path.join(base_dir, name)
+            files[path] = stat_key(path)
+    return files
+
+
+def watch(args, profile=None):
+    """Build, then rebuild whenever the csv file or a base file changes.
+
+    Runs until interrupted. The templates, hashes and the patch sheet stay
+    loaded between builds; only changed files are read again. A
+    rebuild of no more outputs than there are workers runs in this process
+    on these warm templates, since new workers would parse every base file
+    again. A build that fails, e.g. on a Logic project still being copied
+    into base_dir, is reported and retried on the next change."""
+    files = None
+    force = args.force
+    try:
+        while True:
+            try:
+                new_files = watched_files(args.csv_file, args.base_dir)
+            except OSError:
+                # a file is being replaced right now, look again
+                time.sleep(args.interval)
+                continue
+            if new_files != files:
+                if files is not None:
+                    changed = [path for path in new_files.keys() | files.keys()
+                               if new_files.get(path) != files.get(path)]
+                    print(f'Changed: {", ".join(sorted(changed))}')
+                start = time.perf_counter()
+                files = new_files
+                try:
+                    build(args, profile, force=force, inline_jobs=args.jobs)
+                except (OSError, ValueError) as e:
+                    print(f'Error: build failed: {e}. Watching for changes.')
+                    continue
+                # only the first build is forced
+                force = False
+                print(f'Rebuilt in '
+                      f'{(time.perf_counter() - start) * 1000:.0f} ms. '
+                      f'Watching for changes.')
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        print('Stopped watching.')
+    return 0
 
 
 if __name__ == '__main__':
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+import os
+import hashlib
+import threading
+
+import logic_rename
+import primitives
+from scene import Scene, SceneTemplate
+
+
+def stat_key(file):
+    """Return what changes when a file, or any file of a Logic project,
+    changes: modification times and sizes."""
+    if not os.path.isdir(file):
+        stat = os.stat(file)
+        return stat.st_mtime_ns, stat.st_size
+    key = []
+    for root, dirs, files in os.walk(file):
+        dirs.sort()
+        for name in sorted(files):
+            stat = os.stat(os.path.join(root, name))
+            key.append((os.path.relpath(root, file), name, stat.st_mtime_ns,
+                        stat.st_size))
+    return tuple(key)
+
+
+def hash_base(file):
+    """Return a content hash of a base scene or a whole Logic project."""
+    h = hashlib.sha256()
+    if os.path.isdir(file):
+        paths = []
+        for root, dirs, files in os.walk(file):
+            paths.extend(os.path.join(root, name) for name in files)
+        paths.sort()
+    else:
+        paths = [file]
+    for path in paths:
+        h.update(os.path.relpath(path, file).encode() + b'\0')
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                h.update(chunk)
+    return h.hexdigest()
+
+
+class TemplateCache:
+    """Compiled scene and project templates, patch sheets and hashes of
+    base files, reused until their file changes (by stat_key). Safe to share between
+    threads: a file being loaded only blocks the users of that file."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (kind, file) -> lock held while loading it
+        self._loading = {}
+        # (kind, file) -> (key, template or hash)
+        self._entries = {}
+
+    def get(self, kind, file, key, load):
+        """Return load() for file, reused until key changes."""
+        with self._lock:
+            lock = self._loading.setdefault((kind, file), threading.Lock())
+        with lock:
+            entry = self._entries.get((kind, file))
+            if entry is None or entry[0] != key:
+                entry = (key, load())
+                self._entries[(kind, file)] = entry
+            return entry[1]
+
+    def scene(self, file):
+        return self.get('scene', file, stat_key(file),
+                        lambda: SceneTemplate(Scene.load(file)))
+
+    def project(self, file, names):
+        names = tuple(names)
+        # only ProjectData is read into the template
+        key = (stat_key(os.path.join(file, logic_rename.PROJECT_DATA)),
+               names)
+        return self.get('project', file, key,
+                        lambda: logic_rename.ProjectTemplate(file, names))
+
+    def sheet(self, csv_file):
+        """The patch sheet of csv_file, see primitives.load_patch_sheet."""
+        return self.get('sheet', csv_file, stat_key(csv_file),
+                        lambda: primitives.load_patch_sheet(csv_file))
+
+    def hash(self, file):
+        return self.get('hash', file, stat_key(file),
+                        lambda: hash_base(file))
+
+
+# the cache of this process, shared by session_build and api
+templates = TemplateCache()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+import os
+import unittest
+
+import osc
+from scene import Scene
+
+BASE_SCENE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'Bases', 'Ex_Scene.scn')
+
+
+def _edited(scene):
+    """Return a copy of scene with a few faders, sends and names changed."""
+    edited = scene.copy()
+    edited['/ch/01/mix'] = 'ON  -6.0 ON +0 OFF  -6.0'
+    edited['/ch/02/mix/13'] = 'ON  -10.0 +0 PRE'
+    edited['/ch/03/config'] = '"Lead" 1 RD 19'
+    edited['/dca/1'] = 'ON  +0.0'
+    return edited
+
+
+class TestPush(unittest.TestCase):
+
+    def test_push_retries_lost_packets(self):
+        scene = Scene.load(BASE_SCENE)
+        edited = _edited(scene)
+        changes = osc.scene_changes(scene, edited)
+        self.assertEqual(len(changes), 4)
+        with osc.X32Emulator(scene.copy(), drop=2) as x32, \
+                osc.X32Client('127.0.0.1', x32.port, timeout=0.1) as client:
+            failed = client.push(changes)
+            first_round = len(client._bundles(changes)) + len(changes)
+            self.assertEqual(failed, [])
+            self.assertEqual(x32.drop, 0)
+            # the lost packets were sent again
+            self.assertGreater(len(x32.packets), first_round)
+            for path, args in changes.items():
+                self.assertEqual(x32.scene[path], args)
+
+    def test_push_reports_lines_never_acknowledged(self):
+        scene = Scene.load(BASE_SCENE)
+        changes = osc.scene_changes(scene, _edited(scene))
+        with osc.X32Emulator(scene.copy(), drop=1000) as x32, \
+                osc.X32Client('127.0.0.1', x32.port, timeout=0.02,
+                              retries=1) as client:
+            self.assertEqual(sorted(client.push(changes)), sorted(changes))
+
+
+class TestPull(unittest.TestCase):
+
+    def test_push_then_pull_round_trip(self):
+        scene = Scene.load(BASE_SCENE)
+        edited = _edited(scene)
+        with osc.X32Emulator(scene.copy(), drop=3) as x32:
+            with osc.X32Client('127.0.0.1', x32.port,
+                               timeout=0.1) as client:
+                self.assertEqual(
+                    client.push(osc.scene_changes(scene, edited)), [])
+            # lose the first queries of the pull too
+            x32.drop = 5
+            pulled, missing = osc.pull_scene(scene, '127.0.0.1', x32.port,
+                                             timeout=0.5)
+            self.assertEqual(x32.drop, 0)
+        self.assertEqual(missing, [])
+        self.assertEqual(list(pulled.items()), list(edited.items()))
+
+    def test_pull_keeps_unanswered_lines(self):
+        scene = Scene.load(BASE_SCENE)
+        template = scene.copy()
+        template['/not/on/the/desk'] = 'ON'
+        with osc.X32Emulator(scene.copy()) as x32:
+            # long enough for a busy machine to answer every real path
+            pulled, missing = osc.pull_scene(template, '127.0.0.1', x32.port,
+                                             timeout=0.5, retries=1)
+        self.assertEqual(missing, ['/not/on/the/desk'])
+        self.assertEqual(pulled['/not/on/the/desk'], 'ON')
+
+
+if __name__ == '__main__':
+    unittest.main()
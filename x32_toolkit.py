@@ -2,17 +2,26 @@
 
 import re
 import sys
-import shutil
 import os
-import fileinput
-import csv
-
-import pandas as pd
+import time
+import argparse
 
+import osc
+import instrument
 import primitives
+from scene import Scene, SceneTemplate, Journal
 
-MAX_BLOCKS = 4
 BLOCK_SIZE = 8
+# the output source index of the first strip of a type, minus one
+OUTPUT_SOURCE_OFFSETS = {'bus': 3, 'mtx': 19, 'ch': 25, 'auxin': 57,
+                         'fxrtn': 65}
+SEND_ARGS_RE = re.compile(r'(?P<head>\S+ +\S+)(?P<tail>.*)$')
+# a bitmask of strips, the rightmost bit is strip 1: the DCAs of a grp line
+# or the talkback destinations (buses, then LR and M/C)
+DCA_BITS_RE = re.compile(r'%(?P<bits>[01]+)')
+TALK_PATH_RE = re.compile(r'/config/talk/[AB]$')
+OUTPUT_SOURCE_RE = re.compile(r'(?P<pre> *)(?P<source>\d+)(?P<post>.*)$')
+FX_SOURCE_RE = re.compile(r'MIX(\d\d)')
 
 
 def nz_mod(a, b):
@@ -22,131 +31,291 @@ def nz_mod(a, b):
         return a % b
 
 
-def _change_scene_name(wip_file, new_name):
-    for line in fileinput.input(wip_file, inplace=True):
-        m = re.match(r'(?P<pre>#.*# )".*?"(?P<post> .*)$',
-                     line)
-        if m is not None:
-            print(f'{m.group("pre")}"{new_name}"{m.group("post")}')
-        else:
-            print(line, end='')
-    fileinput.close()
-
-
-def swap_channels(wip_file, swap_dict):
-    for line in fileinput.input(wip_file, inplace=True):
-        for channel in swap_dict:
-            m = re.match(fr'/ch/{channel:0>2}/(?P<Payload>.*)$',  # noqa E
-                         line)
-            if m is not None:
-                print((f'/ch/{swap_dict[channel]:0>2}/'
-                       f'{m.group("Payload")}'))
-                break
-        else:
-            print(line, end='')
-    fileinput.close()
-
-
-def rename(wip_file, rename_dict, mode):
-    failed = {**rename_dict}
-    enabled = set()
-    for c in mode:
-        if c == 'a':
-            enabled.add('auxin')
-        elif c == 'b':
-            enabled.add('bus')
-        elif c == 'c':
-            enabled.add('ch')
+def _change_scene_name(scene, new_name):
+    scene.name = new_name
+
+
+class StripPermutation:
+    """Moves whole strips in one pass over a scene.
+
+    moves maps a strip type (ch, auxin, fxrtn, bus, mtx, dca) to a
+    swap_dict of strip numbers, which must be a permutation. Every path of
+    a moved strip is renumbered, and so is every reference to it:
+
+    - the sends of channels, aux ins and FX returns to moved buses, and
+      the sends of buses and the main strips to moved matrices
+    - the DCA assignments in the grp lines
+    - the buses in the destinations of talkback A and B
+    - the sources of all outputs: buses, matrices and direct outs
+    - the MIXnn sources of the FX units
+
+    The headamps stay in place. They belong to the physical inputs, and
+    the input of a channel moves along with its config line.
+
+    Stereo links (/config/chlink, /config/buslink, ...) are not changed.
+    Moving one strip of a linked pair apart from the other breaks the
+    link; move both or adjust the link on the desk.
+    """
+
+    def __init__(self, moves):
+        # strip type -> swap_dict without the strips that stay
+        self.numbers = {}
+        # (strip type, number string) -> new number string
+        self.paths = {}
+        for strip_type, swap_dict in moves.items():
+            count = primitives.STRIP_COUNTS.get(strip_type)
+            if count is None:
+                raise ValueError(f'{strip_type} strips can not be moved')
+            if any(n not in range(1, count + 1)
+                   for item in swap_dict.items() for n in item):
+                raise ValueError(f'{strip_type} numbers go from 1 to {count}')
+            if sorted(swap_dict) != sorted(swap_dict.values()):
+                raise ValueError(f'{strip_type} moves are no permutation')
+            swap_dict = {k: v for k, v in swap_dict.items() if k != v}
+            self.numbers[strip_type] = swap_dict
+            for k, v in swap_dict.items():
+                self.paths[(strip_type, primitives.strip_number(
+                    strip_type, k))] = primitives.strip_number(strip_type, v)
+        self.sources = {OUTPUT_SOURCE_OFFSETS[t] + k:
+                        OUTPUT_SOURCE_OFFSETS[t] + v
+                        for t, swap_dict in self.numbers.items()
+                        if t in OUTPUT_SOURCE_OFFSETS
+                        for k, v in swap_dict.items()}
+
+    def __bool__(self):
+        return bool(self.paths)
+
+    def _send(self, path, args, new_path, lookup):
+        m = primitives.SEND_RE.match(path)
+        if m is None:
+            return None
+        if m.group('type') in ('bus', 'main'):
+            send_type = 'mtx'
         else:
-            print(f'Error: mode bit {c} does not exist.')
-            return
-    status = ''
-    for line in fileinput.input(wip_file, inplace=True):
-        m = primitives.CHANNEL_RE.match(line)
+            send_type = 'bus'
+        slot = int(m.group('slot'))
+        dest = self.numbers.get(send_type, {}).get(slot)
+        if dest is None:
+            return None
+        dest_slot = f'{dest:0>2}'
+        # pan and tap of a send belong to the odd slot of a pair. They stay
+        # in place if the send moves between an odd and an even slot.
+        if dest % 2 != slot % 2 and lookup is not None and args is not None:
+            m_dest = SEND_ARGS_RE.match(lookup(path[:-2] + dest_slot) or '')
+            m_src = SEND_ARGS_RE.match(args)
+            if m_src is not None and m_dest is not None:
+                args = m_src.group('head') + m_dest.group('tail')
+        return new_path[:-2] + dest_slot, args
+
+    def _bits(self, args, strip_type):
+        """Permute the first bitmask of args by the moves of strip_type.
+        Bits beyond the strips of that type stay in place."""
+        moves = self.numbers[strip_type]
+
+        def permute(m):
+            bits = m.group('bits')
+            n = len(bits)
+            new = ['0'] * n
+            for i in range(1, n + 1):
+                if bits[n - i] == '1':
+                    new[n - moves.get(i, i)] = '1'
+            return '%' + ''.join(new)
+        return DCA_BITS_RE.sub(permute, args, count=1)
+
+    def _source(self, args):
+        m = OUTPUT_SOURCE_RE.match(args)
         if m is None:
-            print(line, end='')
-            continue
-        # get data for the match
-        ch_type = m.group('type')
-        ch_num = m.group('ch_num')
-        ch_name = m.group('name')
-        ch_pic_num = m.group('pic_num')
-        ch_color = m.group('color')
-        # the channel type was not enabled. do not change the line
-        if ch_type not in enabled:
-            print(line, end='')
-            continue
-        for name in rename_dict:
-            if ch_name != name:
+            return args
+        source = self.sources.get(int(m.group('source')))
+        if source is None:
+            return args
+        return f'{m.group("pre")}{source}{m.group("post")}'
+
+    def _fx_source(self, args):
+        buses = self.numbers['bus']
+        return FX_SOURCE_RE.sub(
+            lambda m: f'MIX{buses.get(int(m.group(1)), int(m.group(1))):0>2}',
+            args)
+
+    def rewrite(self, path, args, lookup=None):
+        """Return the new (path, args) of one line of a scene.
+
+        lookup returns the args of a path of the original scene. It is only
+        needed to keep pan and tap of sends that move between an odd and an
+        even slot; without it, those sends move whole."""
+        new_path = path
+        m = primitives.STRIP_PATH_RE.match(path)
+        if m is not None:
+            dest = self.paths.get((m.group('type'), m.group('ch_num')))
+            if dest is not None:
+                new_path = (f'{path[:m.start("ch_num")]}{dest}'
+                            f'{path[m.end("ch_num"):]}')
+        if args is None:
+            return new_path, args
+        if path.endswith('/grp'):
+            if 'dca' in self.numbers:
+                args = self._bits(args, 'dca')
+        elif '/mix/' in path:
+            send = self._send(path, args, new_path, lookup)
+            if send is not None:
+                new_path, args = send
+        elif path.startswith('/outputs/'):
+            if self.sources and primitives.OUTPUT_RE.match(path):
+                args = self._source(args)
+        elif path.startswith('/fx/') and path.endswith('/source'):
+            if 'bus' in self.numbers:
+                args = self._fx_source(args)
+        elif TALK_PATH_RE.match(path):
+            if 'bus' in self.numbers:
+                args = self._bits(args, 'bus')
+        return new_path, args
+
+    def apply(self, scene):
+        instrument.count('lines scanned', len(scene))
+        moved = {}
+        for path, args in scene.items():
+            new_path, new_args = self.rewrite(path, args, scene.get)
+            if new_path != path or new_args != args:
+                moved[new_path] = new_args
+        instrument.count('lines rewritten', len(moved))
+        scene.update(moved)
+
+
+def permute_strips(scene, moves):
+    """Move whole strips of scene, see StripPermutation."""
+    with instrument.phase('permute strips'):
+        StripPermutation(moves).apply(scene)
+
+
+def swap_channels(scene, swap_dict):
+    permute_strips(scene, {'ch': swap_dict})
+
+
+def rename(scene, rename_dict, strip_types=None):
+    """Rename the strips of scene by rename_dict (old name -> new name).
+
+    Keys of rename_dict may be exact names, ``glob:`` globs or ``re:``
+    expressions, see primitives.RenameRules. Only strips of strip_types
+    are renamed, all strip types with a config line if it is None.
+
+    Returns a primitives.RenameReport."""
+    return rename_steps(scene, [rename_dict], strip_types)
+
+
+def rename_steps(scene, rename_dicts, strip_types=None):
+    """Rename the strips of scene by every rename_dict of rename_dicts in
+    turn, see rename. Each strip name goes through all steps and its
+    config line is written once.
+
+    Returns a primitives.RenameReport of the original and final names."""
+    with instrument.phase('rename'):
+        steps = [primitives.RenameRules(d) for d in rename_dicts]
+        report = primitives.RenameReport()
+        matched = [set() for _ in steps]
+        for (ch_type, ch_num), name in list(scene.names.items()):
+            if strip_types is not None and ch_type not in strip_types:
                 continue
-            # get the input if an auxin or regular channel was matched
-            if ch_type == 'auxin' or ch_type == 'ch':
-                ch_input = m.group('input')
-            else:
-                ch_input = ''
-            status += (f'\n{ch_type.upper()} '
-                       f'{m.group("ch_num")}: '
-                       f'{name} -> {rename_dict[name]}')
-            if rename_dict[name] is '':
-                ch_pic_num = '1'
-                ch_color = 'OFF'
-                ch_input = '0'
-            # this name has been found.
-            if name in failed:
-                failed.pop(name)
-            print(f'/{ch_type}/{ch_num}/config '
-                  f'"{rename_dict[name]}" {ch_pic_num} {ch_color} {ch_input}')
-            break
-        else:
-            # Did not find the name in rename_dict. not changing
-            print(line, end='')
-    fileinput.close()
-    status += '\n'.join([f'Failed to find {k} to {v}'
-                         for k, v in failed.items()])
-    return status
-
-
-def show_scene(wip_file):
-    name_dict = {}
-    with open(wip_file, 'r') as f:
-        for line in f:
-            m = re.match(r'/ch/(?P<ch_num>\d\d)/config "(?P<name>.*?)" .*$',
-                         line)
-            if m is not None:
-                name_dict[int(m.group('ch_num'))] = m.group('name')
-    # the longest channel name in the scene
-    max_name_len = {i: max([len(v)
-                            for k, v in name_dict.items()
+            new_name = None
+            for rules, step_matched in zip(steps, matched):
+                rule = rules.match(name if new_name is None else new_name)
+                if rule is not None:
+                    key, new_name = rule
+                    step_matched.add(key)
+            if new_name is None:
+                continue
+            path = f'/{ch_type}/{ch_num}/config'
+            m = primitives.CHANNEL_RE.match(f'{path} {scene[path]}')
+            if m is None:
+                continue
+            scene[path] = primitives.renamed_config(m, new_name)
+            report.applied.append((ch_type, ch_num, name, new_name))
+        report.missing = [(k, v)
+                          for rules, step_matched in zip(steps, matched)
+                          for k, v in rules.rename_dict.items()
+                          if k not in step_matched]
+        instrument.count('names scanned', len(scene.names))
+        instrument.count('name matches', len(report.applied))
+        return report
+
+
+def _show_strips(strips):
+    """Print (label, name) pairs, BLOCK_SIZE strips per row."""
+    # the longest strip name in each column
+    max_name_len = {i: max([len(name)
+                            for k, (_, name) in enumerate(strips, 1)
                             if (nz_mod(k, BLOCK_SIZE) == i)] + [7])
                     for i in range(1, BLOCK_SIZE + 1)}
-    print()
-    for j in range(MAX_BLOCKS):
-        # there are no channels anymore
-        if len(name_dict) < j * BLOCK_SIZE:
-            break
-        # numbers of channels on this line
-        chans_on_line = min(len(name_dict) - BLOCK_SIZE * j, BLOCK_SIZE)
+    for j in range(0, len(strips), BLOCK_SIZE):
+        row = strips[j:j + BLOCK_SIZE]
         # length of this line in characters
-        line_len = sum((v + 3 for k, v in max_name_len.items()
-                        if nz_mod(k, BLOCK_SIZE) <= chans_on_line)) + 1
+        line_len = sum(max_name_len[i + 1] + 3 for i in range(len(row))) + 1
         tmp1 = ''
         tmp2 = ''
-        for i in range(chans_on_line):
+        for i, (label, name) in enumerate(row):
             col_len = max_name_len[i + 1] + 2
-            tmp1 += f'|{"CH " + str(j * BLOCK_SIZE + i + 1):^{col_len}s}'  # noqa E501
-            tmp2 += f'|{name_dict[j * BLOCK_SIZE + i + 1]:^{col_len}s}'  # noqa E501
+            tmp1 += f'|{label:^{col_len}s}'
+            tmp2 += f'|{name:^{col_len}s}'
         tmp1 += '|'
         tmp2 += '|'
         # print row header line
         print('-' * line_len)
-        # print channel numbers
+        # print strip labels
         print(tmp1)
-        # print channel names
+        # print strip names
         print(tmp2)
+
+
+def show_scene(scene):
+    strips = {}
+    for (ch_type, ch_num), name in scene.names.items():
+        number = str(int(ch_num)) if ch_num.isdigit() else ch_num.upper()
+        strips.setdefault(ch_type, []).append(
+            (f'{primitives.STRIP_LABELS[ch_type]} {number}', name))
     print()
+    for ch_type in primitives.STRIP_LABELS:
+        if ch_type in strips:
+            _show_strips(strips[ch_type])
+            print()
+
+
+def pairs_swap_dict(swap_list):
+    """Return the swap_dict exchanging every pair of swap_list, or None if
+    a channel appears more than once."""
+    flat_list = [el for tup in swap_list for el in tup]
+    if len(flat_list) != len(set(flat_list)):
+        return None
+    # add swapback
+    return {k: v
+            for first, second in swap_list
+            for k, v in ((first, second), (second, first))}
+
+
+def chain_swap_dict(to_swap, new_pos):
+    """Return the swap_dict moving to_swap to new_pos, shifting the
+    channels in between by one."""
+    if to_swap == new_pos:
+        return {}
+    direction = (to_swap - new_pos) // abs(to_swap - new_pos)
+    smaller = min(to_swap, new_pos)
+    bigger = max(to_swap, new_pos)
+    swap_dict = {k: k + direction
+                 for k in range(smaller + (direction < 0),
+                                bigger + (direction < 0))}
+    swap_dict[to_swap] = new_pos
+    return swap_dict
+
 
+def compose_swaps(first, second):
+    """Return the swap_dict of applying first, then second."""
+    composed = {k: second.get(v, v) for k, v in first.items()}
+    for k, v in second.items():
+        # k was not moved by first, so it is still at position k
+        if k not in first:
+            composed[k] = v
+    return {k: v for k, v in composed.items() if k != v}
 
-def pair_swap(wip_file):
+
+def pair_swap(scene):
     swap_list = []
     print('Give all pairs seperated by spaces. '
           'Each pair on a new line. "c" to end.')
@@ -161,19 +330,19 @@ def pair_swap(wip_file):
         except ValueError:
             break
         swap_list.append((first_chan, second_chan))
-    flat_list = [el for tup in swap_list for el in tup]
-    if len(flat_list) != len(set(flat_list)):
+    swap_dict = pairs_swap_dict(swap_list)
+    if swap_dict is None:
         print('Channel swapped more then once. Aborting.')
         sys.exit()
-    # add swapback
-    swap_dict = {k: v
-                 for first, second in swap_list
-                 for k, v in ((first, second), (second, first))}
-    swap_channels(wip_file, swap_dict)
+    try:
+        swap_channels(scene, swap_dict)
+    except ValueError as e:
+        print(f'Error: {e}. Nothing swapped.')
+        return
     print('Done.')
 
 
-def swap_chain(wip_file):
+def swap_chain(scene):
     while True:
         to_swap = input('Which Channel do you want to move?\n')
         new_pos = input('Where do you want to put the channel?\n')
@@ -187,18 +356,74 @@ def swap_chain(wip_file):
             print('Channel numbers go from 1 to 32.')
             continue
         break
-    direction = (to_swap - new_pos) // abs(to_swap - new_pos)
-    smaller = min(to_swap, new_pos)
-    bigger = max(to_swap, new_pos)
-    swap_dict = {k: k + direction
-                 for k in range(smaller + (direction < 0),
-                                bigger + (direction < 0))}
-    swap_dict[to_swap] = new_pos
-    swap_channels(wip_file, swap_dict)
+    swap_channels(scene, chain_swap_dict(to_swap, new_pos))
     print('Done.')
 
 
-def batch_rename(wip_file):
+def read_script(script_file):
+    """Read a command file into one set of strip moves and a list of
+    rename steps.
+
+    Every line holds one step: ``pairs [type] a b [c d ...]``,
+    ``chain [type] from to`` or ``rename oldname newname``. The strip type
+    (ch, auxin, fxrtn, bus, mtx, dca) defaults to ch. Empty lines and lines
+    starting with ``#`` are ignored. All moves of a strip type are composed
+    into one permutation. Every rename is one step that applies to the
+    names the steps before it left, see rename_steps. The script is
+    applied in a single pass. Raises ValueError naming the offending
+    line."""
+    moves = {}
+    renames = []
+    with open(script_file, 'r') as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if line == '' or line.startswith('#'):
+                continue
+            command, _, rest = line.partition(' ')
+            try:
+                if command == 'rename' or command == 're':
+                    to_rename, new_name = rest.split(' ', 1)
+                    step = {to_rename: new_name}
+                    # compiles the pattern, to report errors by line
+                    primitives.RenameRules(step)
+                    renames.append(step)
+                    continue
+                words = rest.split()
+                strip_type = 'ch'
+                if words and words[0] in primitives.STRIP_COUNTS:
+                    strip_type = words.pop(0)
+                count = primitives.STRIP_COUNTS[strip_type]
+                if command == 'pairs' or command == 'p':
+                    chans = [int(c) for c in words]
+                    if not chans or len(chans) % 2:
+                        raise ValueError('pairs needs pairs of channels')
+                    step = pairs_swap_dict(list(zip(chans[::2], chans[1::2])))
+                    if step is None:
+                        raise ValueError('Channel swapped more then once')
+                elif command == 'chain' or command == 'c':
+                    to_swap, new_pos = (int(c) for c in words)
+                    step = chain_swap_dict(to_swap, new_pos)
+                else:
+                    raise ValueError(f'Unsupported Operation {command}')
+                if any(n not in range(1, count + 1)
+                       for item in step.items() for n in item):
+                    raise ValueError(f'{strip_type} numbers go from 1 to '
+                                     f'{count}')
+            except ValueError as e:
+                raise ValueError(f'{script_file}:{lineno}: {e}') from None
+            moves[strip_type] = compose_swaps(moves.get(strip_type, {}),
+                                              step)
+    return moves, renames
+
+
+def run_script(scene, script_file):
+    """Apply all steps of a command file to scene in one pass."""
+    moves, renames = read_script(script_file)
+    permute_strips(scene, moves)
+    return rename_steps(scene, renames)
+
+
+def batch_rename(scene):
     rename_dict = {}
     while True:
         try:
@@ -207,31 +432,37 @@ def batch_rename(wip_file):
         except ValueError:
             break
         rename_dict[to_rename] = new_name
-    return rename(wip_file, rename_dict, 'abc')
+    return rename(scene, rename_dict)
 
 
-def name_from_csv(wip_file, csv_file=None):
-    df = _get_name_df(csv_file=csv_file)
-    if df is None:
+def name_from_csv(scene, csv_file=None):
+    sheet = primitives._get_name_sheet(csv_file=csv_file)
+    if sheet is None:
         return
     while True:
         session_to_load = input(('Specify one of these existing Sessions to '
                                 'load names from:\n') +
-                                ', '.join(list(df.columns)) + '\n')
-        if session_to_load not in df.columns:
+                                ', '.join(sheet) + '\n')
+        if session_to_load not in sheet:
             print('Please choose an existing Session.')
             continue
         break
-    rename_dict = {}
-    for row in df.iterrows():
-        rename_dict[row[0]] = row[1][session_to_load]
-    return rename(wip_file, rename_dict, 'abc')
+    return rename(scene, sheet[session_to_load])
+
 
+def create_named_scene(template, prefix, session_name, rename_dict,
+                       target_dir):
+    """Render the scene for session_name from template into target_dir.
 
-def create_named_scenes(wip_file, target_dir=None,
+    Returns the path of the new scene."""
+    new_file = os.path.join(target_dir, f'{prefix}_{session_name}.scn')
+    with instrument.phase('render scene', base=prefix, session=session_name):
+        template.render(rename_dict, f'{prefix}_{session_name}', new_file)
+    return new_file
+
+
+def create_named_scenes(scene, prefix, target_dir=None,
                         csv_file=None):
-    # the local backup for this function
-    loc_backup = ''
     # get a target_dir to work to
     if target_dir is None:
         target_dir = input('Specify a target directory.\n')
@@ -239,149 +470,290 @@ def create_named_scenes(wip_file, target_dir=None,
         os.mkdir(target_dir)
     elif not os.path.isdir(target_dir):
         print(f'Error: {target_dir} is a file.')
-    # get the dataframe for names
-    df = primitives._get_name_df(csv_file)
-    if df is None:
+    # get the patch sheet for names
+    sheet = primitives._get_name_sheet(csv_file)
+    if sheet is None:
         return
+    template = SceneTemplate(scene)
     count = 0
-    m = re.match(r'(\.)?(?P<pref>.*)\..*(\.wip)?$', wip_file)
-    if m is None:
-        print('Failure. Nothing written.')
-        return
-    prefix = m.group('pref')
-    prefix = os.path.basename(prefix)
-    for session_name in df.columns:
-        if session_name.startswith('#'):
-            continue
-        rename_dict = {row[0]: row[1][session_name] for row in df.iterrows()}
-        loc_backup = save_backup(wip_file, '', silent=True)
-        try:
-            rename(wip_file, rename_dict, 'abc')
-            _change_scene_name(wip_file, f'{prefix}_{session_name}')
-            shutil.copy(wip_file, os.path.join(target_dir,
-                                               f'{prefix}_{session_name}.scn'))
-        except Exception as e:
-            raise e
-        finally:
-            revert_from_backup(wip_file, backup=loc_backup)
+    for session_name, rename_dict in sheet.items():
+        create_named_scene(template, prefix, session_name, rename_dict,
+                           target_dir)
         count += 1
-    purge(loc_backup)
-    print(f'Scene create done for {wip_file}. '
+    print(f'Scene create done for {prefix}. '
           f'Created {count} new scenes in {target_dir}.')
 
 
-def save_backup(wip_file, new_file_name=None, silent=False):
+def save_backup(scene, scene_file, new_file_name=None, silent=False):
     if new_file_name is None:
         new_file_name = input('Specify a name for the backup '
                               'or leave blank for automatic name.\n')
     if new_file_name == '':
-        new_file_name = wip_file + '.backup'
-    if not os.path.exists(new_file_name):
+        new_file_name = scene_file + '.backup'
+    if os.path.dirname(new_file_name):
         os.makedirs(os.path.dirname(new_file_name), exist_ok=True)
-    shutil.copy(wip_file, new_file_name)
+    scene.export(new_file_name)
     if not silent:
         print(f'Saved backup as {new_file_name}')
     return new_file_name
 
 
-def revert_from_backup(wip_file, backup=''):
-    if backup == '':
-        print('No backup was set.')
-        return
-    shutil.copy(backup, wip_file)
+def undo(journal, steps=1):
+    for _ in range(steps):
+        label = journal.undo()
+        if label is None:
+            print('Nothing to undo.')
+            break
+        print(f'Undid {label}.')
 
 
-def purge(scene):
-    if os.path.exists(scene):
-        os.remove(scene)
+def redo(journal, steps=1):
+    for _ in range(steps):
+        label = journal.redo()
+        if label is None:
+            print('Nothing to redo.')
+            break
+        print(f'Redid {label}.')
 
 
-def export_changes(wip_file):
+def export_changes(scene):
     export_name = input('Enter the name for the file to export to.\n')
-    if export_name in os.listdir():
+    if os.path.exists(export_name):
         confirm = input('Error: file exists. Do you want to override? (y/n)\n')
-        if confirm == 'y':
-            os.remove(export_name)
-        else:
+        if confirm != 'y':
             return
-    shutil.copy(wip_file, export_name)
+    scene.export(export_name)
     print(f'Done. State saved to {export_name}.')
 
 
+def _x32_address(address):
+    host, _, port = address.partition(':')
+    return host, int(port) if port else osc.X32_PORT
+
+
+def push_changes(scene, pushed, x32_address):
+    """Send every line of scene that differs from pushed to the console.
+
+    pushed is the state last sent to the console and is updated with the
+    lines the console acknowledged."""
+    changes = osc.scene_changes(pushed, scene)
+    if not changes:
+        print('Nothing to push.')
+        return
+    start = time.perf_counter()
+    try:
+        with instrument.phase('push'), \
+                osc.X32Client(*_x32_address(x32_address)) as client:
+            failed = client.push(changes)
+        instrument.count('lines pushed', len(changes))
+    except (OSError, ValueError) as e:
+        print(f'Error: could not push to {x32_address}: {e}')
+        return
+    for path, args in changes.items():
+        if path not in failed:
+            pushed[path] = args
+    print(f'Pushed {len(changes) - len(failed)} lines to {x32_address} in '
+          f'{(time.perf_counter() - start) * 1000:.0f} ms.')
+    if failed:
+        print(f'Error: {len(failed)} lines were not acknowledged: '
+              f'{", ".join(failed)}')
+
+
+def pull_changes(scene, x32_address):
+    """Read the state of the console into scene, using the paths of scene.
+
+    Returns True if the console answered."""
+    start = time.perf_counter()
+    try:
+        with instrument.phase('pull'):
+            pulled, missing = osc.pull_scene(scene,
+                                             *_x32_address(x32_address))
+    except (OSError, ValueError) as e:
+        print(f'Error: could not pull from {x32_address}: {e}')
+        return False
+    read = len(scene) - len(missing) - (scene.header is not None)
+    if read == 0:
+        print(f'Error: {x32_address} did not answer.')
+        return False
+    scene.update(pulled)
+    print(f'Pulled {read} lines from {x32_address} in '
+          f'{(time.perf_counter() - start) * 1000:.0f} ms.')
+    if missing:
+        print(f'Warning: {len(missing)} lines were not answered and kept '
+              f'as they were.')
+    return True
+
+
 def main():
-    if len(sys.argv) == 1:
-        scene = input('Specify a file to work on:\n')
+    parser = argparse.ArgumentParser(
+        description='Move and rename channels of an X32 scene.')
+    parser.add_argument('scene', nargs='?')
+    parser.add_argument('command', nargs='?',
+                        help='the first command of the interactive session')
+    parser.add_argument('--script',
+                        help='apply the pairs, chain and rename steps of '
+                             'this file in one pass instead of starting an '
+                             'interactive session')
+    parser.add_argument('-o', '--output',
+                        help='where --script writes the scene '
+                             '(default: overwrite the scene)')
+    parser.add_argument('--x32', metavar='HOST[:PORT]',
+                        help='the console "push" sends changes to. With '
+                             '--script, the changes of the script are '
+                             'pushed as well')
+    parser.add_argument('--pull', action='store_true',
+                        help='start from the state of the console given by '
+                             '--x32 instead of the scene, which only gives '
+                             'the lines to read. Without --script or a '
+                             'command, the state is written to --output')
+    parser.add_argument('--profile', metavar='FILE',
+                        help='record the time of every phase and counters '
+                             'of the work done, save them as json to FILE '
+                             'on exit and print a summary')
+    args = parser.parse_args()
+    profile = instrument.enable() if args.profile else None
+    try:
+        run(args)
+    finally:
+        if profile is not None:
+            profile.save(args.profile)
+            print(profile.summary())
+            print(f'Profile saved to {args.profile}.')
+
+
+def run(args):
+    if args.scene is None:
+        scene_file = input('Specify a file to work on:\n')
     else:
-        scene = sys.argv[1]
-    global wip_file
-    global backup
-    wip_file = os.path.join(os.path.dirname(scene),
-                            '.' + os.path.basename(scene) + '.wip')
-    wip_file = shutil.copy(scene, wip_file)
-    backup = shutil.copy(wip_file, wip_file + '.backup')
-    if not os.path.exists(scene):
+        scene_file = args.scene
+    if not os.path.exists(scene_file):
         print('Error: specified scene file does not exist.')
         return
-    if len(sys.argv) <= 2:
+    scene = Scene.load(scene_file)
+    if args.pull:
+        if args.x32 is None:
+            print('Error: --pull needs the address of the console in --x32.')
+            sys.exit(1)
+        if not pull_changes(scene, args.x32):
+            sys.exit(1)
+        if (args.script is None and args.command is None
+                and args.output is not None):
+            scene.export(args.output)
+            print(f'Done. State saved to {args.output}.')
+            return
+    if args.script is not None:
+        loaded = scene.copy()
+        try:
+            status = run_script(scene, args.script)
+        except (OSError, ValueError) as e:
+            print(f'Error: {e}. Nothing written.')
+            sys.exit(1)
+        output = args.output or scene_file
+        scene.export(output)
+        print('Done renaming the following names:')
+        print(status)
+        print(f'Done. State saved to {output}.')
+        if args.x32 is not None:
+            push_changes(scene, loaded, args.x32)
+        return
+    journal = Journal(scene)
+    # the state of the console, as far as it is known
+    pushed = scene.copy()
+    x32_address = args.x32
+    prefix = os.path.splitext(os.path.basename(scene_file))[0]
+    if args.command is None:
         print('Welcome to the x32 toolkit.\n'
               'Swap pairs of channels with "pairs".\n'
               'Swap a specified channel to a new place with "chain".\n'
               'Show Channel Names for this scene with "names".\n'
               'Rename Channels with "rename".\n'
               'Load Names from csv with "load".\n'
-              'Save backup with "backup".\n'
-              'Revert the original file to the Backup with "revert".\n'
+              'Undo the last command with "undo", optionally followed by '
+              'the number of commands.\n'
+              'Redo undone commands with "redo", likewise.\n'
+              'Revert to the scene as it was loaded with "revert".\n'
+              'Save backup to a file with "backup".\n'
               'Export the current state to a new file with "export".\n'
+              'Send the changes to the console with "push".\n'
+              'Read the state of the console with "pull".\n'
               'Create all named Sessionfiles '
               'from this scene as base with "create".\n'
               'Quit this programm with "quit".')
     first_round_flag = True
     while True:
-        if first_round_flag and len(sys.argv) > 2:
-            command = sys.argv[2]
+        if first_round_flag and args.command is not None:
+            command = args.command
             first_round_flag = False
         else:
             command = input('X32Toolkit>>')
+        command, _, count = command.partition(' ')
+        try:
+            count = int(count) if count else 1
+        except ValueError:
+            print('Please enter a number of commands.')
+            continue
         if command.startswith('q') or command.startswith('Q'):
             break
         elif command == 'pairs' or command == 'p':
             print('Swapping pairs.')
-            pair_swap(wip_file)
+            with journal.record('pairs'):
+                pair_swap(scene)
         elif command == 'chain' or command == 'c':
             print('Swapping chain.')
-            swap_chain(wip_file)
+            with journal.record('chain'):
+                swap_chain(scene)
         elif command == 'names' or command == 'n':
-            show_scene(wip_file)
+            show_scene(scene)
         elif command == 'rename' or command == 're':
-            status = batch_rename(wip_file)
+            try:
+                with journal.record('rename'):
+                    status = batch_rename(scene)
+            except ValueError as e:
+                print(f'Error: {e}')
+                continue
             print('Done renaming the following names:')
             print(status)
         elif command == 'load' or command == 'ldc':
             print('Loading Names from CSV.')
-            status = name_from_csv(wip_file)
+            try:
+                with journal.record('load'):
+                    status = name_from_csv(scene)
+            except ValueError as e:
+                print(f'Error: {e}')
+                continue
             print('Done renaming the following names:')
             print(status)
+        elif command == 'undo' or command == 'u':
+            undo(journal, count)
+        elif command == 'redo':
+            redo(journal, count)
         elif command == 'revert' or command == 'rev':
-            revert_from_backup(wip_file, backup=backup)
-            print(f'Restored last backup.')
+            undo(journal, len(journal))
+            print('Reverted to the loaded scene.')
         elif command == 'backup' or command == 'bak':
-            backup = save_backup(wip_file)
-        elif command == 'purge':
-            purge(backup)
-            print('Backup purged.')
+            save_backup(scene, scene_file)
         elif command == 'export' or command == 'ex':
-            export_changes(wip_file)
+            export_changes(scene)
         elif command == 'create' or command == 'cr':
-            create_named_scenes(wip_file, backup=backup)
+            try:
+                create_named_scenes(scene, prefix)
+            except ValueError as e:
+                print(f'Error: {e}')
+        elif command == 'push':
+            if x32_address is None:
+                x32_address = input('Specify the address of the console '
+                                    '(host or host:port).\n')
+            push_changes(scene, pushed, x32_address)
+        elif command == 'pull':
+            if x32_address is None:
+                x32_address = input('Specify the address of the console '
+                                    '(host or host:port).\n')
+            with journal.record('pull'):
+                if pull_changes(scene, x32_address):
+                    pushed = scene.copy()
         else:
             print('Unsupported Operation.')
 
 
 if __name__ == '__main__':
-    try:
-        main()
-    except:  # noqa E722
-        raise
-    finally:
-        purge(wip_file)
-        purge(backup)
+    main()